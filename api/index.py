@@ -4,15 +4,12 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 try:
-    from app import app, db
+    from app import app
 except Exception as e:
     print(f"Import error: {e}")
 
-with app.app_context():
-    try:
-        db.create_all()
-    except Exception as e:
-        print(f"Database initialization error: {str(e)}")
+# Схема не создается при импорте: на Vercel ей владеют миграции (SCHEMA_MODE=migrations),
+# а ревизия сверяется один раз при первом запросе
 
 app.debug = False
 application = app
@@ -1,7 +1,43 @@
+import contextlib
+import functools
+import hashlib
+import json
+import math
+import mimetypes
 import os
-from flask import Flask, render_template, jsonify, request, redirect, url_for
+import re
+import tempfile
+import time
+
+import click
+from flask import Flask, render_template, jsonify, request, redirect, url_for, make_response, abort, \
+    stream_with_context, send_from_directory, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import event, exc
+from sqlalchemy.orm import Session
+from collections import Counter
+from datetime import datetime, date, timedelta
+from itertools import chain
+
+import cache
+import compression
+import dbpool
+import events
+import exporter
+import fragments
+import fulltext
+import ratelimit
+import rollups
+from clustering import GridClusterIndex
+import geocoder as gazetteer
+import importer
+import importprofile
+import metrics
+from geo import bbox_contains, geohash_encode, geohash_ranges, haversine_km, radius_bbox, tile_bbox, tile_for
+from pagination import Page, paginate
+from places import alias_key, city_key, location_key, normalize_text, place_index, place_key
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'KAPIBARA2025SKANAPP'
@@ -16,7 +52,65 @@ if db_url.startswith("postgres://"):
     db_url = db_url.replace("postgres://", "postgresql://", 1)
 app.config['SQLALCHEMY_DATABASE_URI'] = db_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Пул соединений настраивается переменными DB_POOL_* (см. dbpool.py)
+pool_settings = dbpool.settings_from_env()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dbpool.engine_options(db_url, pool_settings)
+# Число объявлений на одной странице списков
+app.config['ANNOUNCEMENTS_PAGE_SIZE'] = int(os.environ.get('ANNOUNCEMENTS_PAGE_SIZE', 20))
+# Кэш страниц: memory — в памяти процесса, sqlite — общий файл для всех воркеров, none — выключен.
+# Ключи содержат версию данных из таблицы data_version, поэтому и кэш в памяти
+# процесса не отдает страницы, устаревшие после записи в другом процессе
+app.config['PAGE_CACHE_BACKEND'] = os.environ.get('PAGE_CACHE_BACKEND', 'memory')
+app.config['PAGE_CACHE_PATH'] = os.environ.get('PAGE_CACHE_PATH',
+                                               os.path.join(tempfile.gettempdir(), 'radar_page_cache.db'))
+app.config['PAGE_CACHE_MAX_ENTRIES'] = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 0)) or None
+app.config['PAGE_CACHE_MAX_BYTES'] = int(os.environ.get('PAGE_CACHE_MAX_BYTES', 0)) or None
+# Кэш тайлов меток использует тот же тип хранилища, что и кэш страниц
+app.config['TILE_CACHE_PATH'] = os.environ.get('TILE_CACHE_PATH',
+                                               os.path.join(tempfile.gettempdir(), 'radar_tile_cache.db'))
+# Сжатие ответов gzip/brotli; тела короче порога отдаются как есть
+app.config['COMPRESS_RESPONSES'] = os.environ.get('COMPRESS_RESPONSES', '1') != '0'
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+# Скомпилированные шаблоны на диске: новые воркеры не компилируют их заново; пусто — выключено
+app.config['TEMPLATE_BYTECODE_DIR'] = os.environ.get('TEMPLATE_BYTECODE_DIR',
+                                                     os.path.join(tempfile.gettempdir(), 'radar_jinja_bytecode'))
+# Сколько фрагментов {% cache %} держать в памяти процесса; 0 — тег не кэширует
+app.config['FRAGMENT_CACHE_MAX_ENTRIES'] = int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 8192))
+# События меток для /events: database — из журнала marker_event, общего для всех
+# процессов, local — только события своего процесса (один процесс, тесты)
+app.config['EVENTS_BACKEND'] = os.environ.get('EVENTS_BACKEND', 'database')
+app.config['EVENTS_POLL_INTERVAL'] = float(os.environ.get('EVENTS_POLL_INTERVAL', 1.0))
+# Предел одновременных потоков /events на процесс: каждый занимает поток воркера,
+# поэтому под gunicorn он должен быть меньше --threads
+app.config['SSE_MAX_CONNECTIONS'] = int(os.environ.get('SSE_MAX_CONNECTIONS', 16))
+# Через столько секунд поток закрывается и браузер переподключается с Last-Event-ID
+app.config['SSE_MAX_SECONDS'] = int(os.environ.get('SSE_MAX_SECONDS', 300))
+# Ограничение частоты запросов: memory — в памяти процесса, sqlite — общий файл
+# для всех воркеров, none — выключено
+app.config['RATELIMIT_BACKEND'] = os.environ.get('RATELIMIT_BACKEND', 'memory')
+app.config['RATELIMIT_PATH'] = os.environ.get('RATELIMIT_PATH',
+                                              os.path.join(tempfile.gettempdir(), 'radar_ratelimit.db'))
+# Сколько поисковых запросов и выгрузок процесс выполняет одновременно, остальным — 503
+app.config['SEARCH_MAX_CONCURRENCY'] = int(os.environ.get('SEARCH_MAX_CONCURRENCY', 8))
+# Число прокси перед приложением: адрес клиента берется из X-Forwarded-For только от них
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+# Если задан, /metrics отдается только с заголовком Authorization: Bearer <токен>
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+# Секрет, который Vercel Cron передает в заголовке Authorization; без него /tasks/* выключены
+app.config['CRON_SECRET'] = os.environ.get('CRON_SECRET')
+# Схема БД: create — db.create_all() при первом запросе (локальная разработка),
+# migrations — схемой владеет Alembic, при старте только сверяется ревизия
+app.config['SCHEMA_MODE'] = os.environ.get('SCHEMA_MODE', 'create')
 db = SQLAlchemy(app)
+with app.app_context():
+    dbpool.install(db.engine, pool_settings)
+# Alembic со всеми зависимостями нужен только командам flask db, поэтому вне CLI
+# он не импортируется: это заметная часть холодного старта функции на Vercel
+if click.get_current_context(silent=True) is not None:
+    from flask_migrate import Migrate
+    migrate = Migrate(app, db, include_name=fulltext.include_name)
 
 class Marker(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -27,104 +121,1401 @@ class Marker(db.Model):
     contact = db.Column(db.String(255), nullable=False)
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
+    # Geohash координат: по префиксам этой колонки bbox и радиус ищутся диапазонами индекса
+    geohash = db.Column(db.String(12), index=True)
+    # Каноническое место из справочника places, определяется по location_text при записи
+    place = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Время последнего изменения, из него строятся ETag и Last-Modified
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        # Фильтр активных меток и курсорная пагинация по (deadline, id)
+        db.Index('ix_marker_deadline_id', 'deadline', 'id'),
+        db.Index('ix_marker_place_deadline_id', 'place', 'deadline', 'id'),
+        # id удаленных и перенесенных в архив меток не выдаются заново
+        {'sqlite_autoincrement': True},
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'help_needed': self.help_needed,
+            'offer': self.offer,
+            'location': self.location_text,
+            'place': self.place,
+            'deadline': self.deadline.strftime('%Y-%m-%d'),
+            'contact': self.contact,
+            'lat': self.latitude,
+            'lng': self.longitude,
+        }
+
+fulltext.register(Marker.__table__)
+
+
+@event.listens_for(Marker, 'before_insert')
+@event.listens_for(Marker, 'before_update')
+def update_marker_derived_fields(mapper, connection, marker):
+    marker.geohash = geohash_encode(marker.latitude, marker.longitude)
+    marker.place = place_key(marker.location_text)
+
+
+class MarkerArchive(db.Model):
+    # Объявления с истекшим сроком, перенесенные из marker командой archive-expired
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    help_needed = db.Column(db.String(255), nullable=False)
+    offer = db.Column(db.String(255), default='')
+    location_text = db.Column(db.String(255), nullable=False)
+    deadline = db.Column(db.Date, nullable=False)
+    contact = db.Column(db.String(255), nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    geohash = db.Column(db.String(12))
+    place = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, server_default=db.func.current_timestamp())
+
+    __table_args__ = (
+        db.Index('ix_marker_archive_deadline_id', 'deadline', 'id'),
+        db.Index('ix_marker_archive_place_deadline_id', 'place', 'deadline', 'id'),
+    )
+
+    to_dict = Marker.to_dict
+
+fulltext.register(MarkerArchive.__table__)
+
+
+class ImportCheckpoint(db.Model):
+    # Сколько записей источника уже импортировано командой import-markers
+    source = db.Column(db.String(255), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class MarkerEvent(db.Model):
+    # Журнал изменений меток для индекса кластеров и подписчиков /events,
+    # хранится EVENT_RETENTION_DAYS дней
+    id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(16), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class IdempotencyKey(db.Model):
+    # Ответы на запросы с заголовком Idempotency-Key; ключ и отпечаток тела —
+    # усеченные sha256, строки старше IDEMPOTENCY_KEY_TTL_HOURS часов удаляются
+    key = db.Column(db.String(32), primary_key=True)
+    fingerprint = db.Column(db.String(32), nullable=False)
+    # None — запрос с этим ключом еще выполняется
+    status = db.Column(db.Integer)
+    body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class DataVersion(db.Model):
+    # Счетчики изменений, общие для всех процессов: увеличиваются в транзакции
+    # записи меток, из них строятся ключи кэша страниц и ETag
+    name = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+class LocationCount(db.Model):
+    # Число объявлений по месту — готовый рейтинг для /rating
+    location = db.Column(db.String(255), primary_key=True)
+    city = db.Column(db.String(255), nullable=False, default='')
+    count = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+    __table_args__ = (
+        db.Index('ix_location_count_city_count', 'city', 'count'),
+    )
+
+
+class LocationDailyCount(db.Model):
+    # Число объявлений по месту за день создания — рейтинг за неделю/месяц
+    day = db.Column(db.Date, primary_key=True)
+    city = db.Column(db.String(255), primary_key=True)
+    location = db.Column(db.String(255), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_location_daily_count_city_day', 'city', 'day'),
+    )
+
+
+def count_marker(connection, location_text, created_at, delta):
+    location = location_key(location_text)
+    city = city_key(location_text)
+    rollups.increment(connection, LocationCount.__table__,
+                      {'location': location}, delta, extra={'city': city})
+    if created_at is not None:
+        rollups.increment(connection, LocationDailyCount.__table__,
+                          {'day': created_at.date(), 'city': city, 'location': location}, delta)
+
+
+@event.listens_for(Marker, 'after_insert')
+def count_inserted_marker(mapper, connection, marker):
+    count_marker(connection, marker.location_text, marker.created_at, 1)
+
+
+@event.listens_for(Marker, 'after_delete')
+def count_deleted_marker(mapper, connection, marker):
+    count_marker(connection, marker.location_text, marker.created_at, -1)
+
+
+@event.listens_for(Marker, 'after_update')
+def count_updated_marker(mapper, connection, marker):
+    history = db.inspect(marker).attrs.location_text.history
+    if not history.has_changes() or not history.deleted:
+        return
+    if location_key(history.deleted[0]) != location_key(marker.location_text):
+        count_marker(connection, history.deleted[0], marker.created_at, -1)
+        count_marker(connection, marker.location_text, marker.created_at, 1)
+
+
+def rebuild_rollups():
+    location_counts = {}
+    daily_counts = {}
+    # Рейтинг учитывает и перенесенные в архив объявления
+    rows = chain.from_iterable(
+        db.session.query(model.location_text, model.created_at).execution_options(yield_per=ROLLUP_BATCH_SIZE)
+        for model in (Marker, MarkerArchive)
+    )
+    for location_text, created_at in rows:
+        location = location_key(location_text)
+        city = city_key(location_text)
+        item = location_counts.setdefault(location, {'location': location, 'city': city, 'count': 0})
+        item['count'] += 1
+        if created_at is not None:
+            key = (created_at.date(), city, location)
+            daily_counts[key] = daily_counts.get(key, 0) + 1
+    db.session.query(LocationCount).delete()
+    db.session.query(LocationDailyCount).delete()
+    if location_counts:
+        db.session.execute(LocationCount.__table__.insert(), list(location_counts.values()))
+    if daily_counts:
+        db.session.execute(LocationDailyCount.__table__.insert(), [
+            {'day': day, 'city': city, 'location': location, 'count': count}
+            for (day, city, location), count in daily_counts.items()
+        ])
+    db.session.commit()
+    return len(location_counts), len(daily_counts)
+
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Пересчитать таблицы рейтинга по всем меткам."""
+    locations, days = rebuild_rollups()
+    click.echo(f'location_count: {locations} rows, location_daily_count: {days} rows')
+
+
+@app.cli.command('import-profile')
+@click.option('--limit', default=15, help='Сколько самых дорогих пакетов показать.')
+def import_profile_command(limit):
+    """Показать, сколько времени занимает импорт приложения по пакетам."""
+    costs = importprofile.profile('app', cwd=os.path.dirname(os.path.abspath(__file__)))
+    for cost in costs[:limit]:
+        click.echo(f'{cost.package:<24}{cost.self_ms:9.1f} ms{cost.modules:6d} modules')
+    click.echo(f'{"total":<24}{sum(cost.self_ms for cost in costs):9.1f} ms')
+
+
+
+_geocoder = None
+
+
+def get_geocoder():
+    # Справочник населенных пунктов читается при первом обращении
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = gazetteer.Geocoder().load(gazetteer.GAZETTEER_FILE)
+    return _geocoder
+
+
+def canonical_settlements():
+    aliases = {}
+    for key, name in place_index.aliases.items():
+        if key != alias_key(name):
+            aliases.setdefault(name, []).append(key)
+    for name, place in sorted(place_index.places.items()):
+        yield gazetteer.Settlement(name, place.latitude, place.longitude, 0, ''), sorted(aliases.get(name, []))
+
+
+def canonical_place(settlement, aliases):
+    # Место справочника places под любым из названий и не дальше 30 км — тот же населенный пункт
+    for name in (settlement.name, *aliases):
+        place = place_index.lookup(name)
+        if place and haversine_km(settlement.latitude, settlement.longitude, place.latitude, place.longitude) <= 30:
+            return place
+    return None
+
+
+@app.cli.command('build-gazetteer')
+@click.argument('sources', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option('--min-population', default=0, help='Пропускать населенные пункты меньше этой численности.')
+@click.option('--alternate-names', multiple=True, type=click.Path(exists=True, dir_okay=False),
+              help='Выгрузка альтернативных названий GeoNames, из нее берутся русские названия.')
+def build_gazetteer_command(sources, min_population, alternate_names):
+    """Собрать data/gazetteer.tsv из справочника мест и выгрузок GeoNames."""
+    russian_names = {}
+    for path in alternate_names:
+        russian_names.update(gazetteer.read_russian_names(path))
+    canonical = {settlement.name: (settlement, aliases) for settlement, aliases in canonical_settlements()}
+    others = []
+    for source in sources:
+        for settlement, aliases in gazetteer.read_geonames(source, min_population, russian_names=russian_names):
+            place = canonical_place(settlement, aliases)
+            if place is not None:
+                # Место из справочника places получает численность, страну и названия из GeoNames:
+                # без численности оно ранжировалось бы ниже любого совпадения из выгрузки
+                known, known_aliases = canonical[place.name]
+                names = [a for a in dict.fromkeys([*known_aliases, settlement.name, *aliases]) if a != place.name]
+                canonical[place.name] = known._replace(population=max(known.population, settlement.population),
+                                                       country=known.country or settlement.country), names
+            elif any(ch in gazetteer.TRANSLIT for ch in settlement.name.lower()):
+                # Места без кириллического названия в русском интерфейсе не подсказываются
+                others.append((settlement, aliases))
+    count = gazetteer.write_gazetteer(gazetteer.GAZETTEER_FILE, chain(canonical.values(), others))
+    click.echo(f'{gazetteer.GAZETTEER_FILE}: {count} settlements')
+
 
 # Default center coordinates
 DEFAULT_CENTER = (51.1605, 71.4704)
+DEFAULT_ZOOM = 12
+
+# Максимальное число меток в одном ответе /api/markers
+MAX_MARKERS_PER_RESPONSE = 2000
+# Верхняя граница параметра per_page в списках объявлений
+MAX_PAGE_SIZE = 100
+# Число мест в рейтинге
+RATING_SIZE = 100
+# Периоды рейтинга и их длина в днях (None — за все время)
+RATING_PERIODS = {'all': None, 'week': 7, 'month': 30}
+ROLLUP_BATCH_SIZE = 1000
+# Размер пачки при переносе в архив и число пачек за один вызов /tasks/archive-expired
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_TASK_MAX_BATCHES = 10
+# Курсоры страниц истории, перешедших от действующих объявлений к архиву
+ARCHIVE_CURSOR_PREFIX = 'archive.'
+# Число меток в одной транзакции import-markers
+IMPORT_BATCH_SIZE = 5000
+# Записи меток с одного адреса: в среднем WRITE_RATE в секунду, всплеском до WRITE_BURST
+WRITE_RATE = 1.0
+WRITE_BURST = 30
+# Новых объявлений с одним контактом за CONTACT_WINDOW секунд
+CONTACT_LIMIT = 50
+CONTACT_WINDOW = 3600
+# Поиск, списки и выгрузка с одного адреса
+SEARCH_RATE = 5.0
+SEARCH_BURST = 30
+# Retry-After для запросов, отклоненных из-за числа одновременных
+ADMISSION_RETRY_AFTER = 1
+# Наибольшее число операций в одном запросе /markers/batch
+MAX_BATCH_OPERATIONS = 500
+# Наибольшая длина текстовых полей метки (столбцы String(255))
+MAX_MARKER_TEXT = 255
+# Сколько строк выгрузки читается из курсора за раз
+EXPORT_BATCH_SIZE = 1000
+# Сколько дней хранится журнал marker_event и сколько событий помнит процесс
+EVENT_RETENTION_DAYS = 1
+# Сколько часов повтор запроса с тем же Idempotency-Key возвращает сохраненный ответ
+IDEMPOTENCY_KEY_TTL_HOURS = 24
+EVENT_HISTORY = 1024
+# Раз в столько секунд в поток /events пишется комментарий, чтобы прокси не закрыли соединение
+SSE_HEARTBEAT_SECONDS = 15
+# Через сколько миллисекунд браузер переподключается к /events
+SSE_RETRY_MS = 3000
+# Радиус поиска "рядом со мной" по умолчанию и максимальный, км
+DEFAULT_RADIUS_KM = 25
+MAX_RADIUS_KM = 500
+# До этого масштаба включительно /api/markers отдает кластеры, дальше — отдельные метки
+CLUSTER_MAX_ZOOM = 13
+# Наибольший масштаб, для которого отдаются тайлы меток (как у подложки OSM)
+TILE_MAX_ZOOM = 18
+# Сколько секунд браузер и CDN могут отдавать тайл без перепроверки
+TILE_MAX_AGE = 60
+
+cluster_index = GridClusterIndex(max_zoom=CLUSTER_MAX_ZOOM)
+
+
+def marker_changes(rows, today):
+    """Изменения журнала marker_event в формате GridClusterIndex.apply."""
+    for event_id, event_type, payload in rows:
+        data = json.loads(payload)
+        active = event_type != 'deleted' and date.fromisoformat(data['deadline']) >= today
+        yield event_id, data['id'], (data['lat'], data['lng']) if active else None
+
+
+def get_cluster_index():
+    # Индекс строится один раз на процесс и пересобирается при смене дня, чтобы
+    # из него выпадали метки с истекшим сроком; в остальное время он догоняет
+    # журнал marker_event, куда пишут изменения все процессы
+    today = datetime.today().date()
+    if cluster_index.built_on == today:
+        rows = db.session.query(MarkerEvent.id, MarkerEvent.type, MarkerEvent.payload) \
+            .filter(MarkerEvent.id > cluster_index.position).order_by(MarkerEvent.id).all()
+        # reset пишет импорт, после которого проще перечитать все метки
+        if not any(event_type == 'reset' for _, event_type, _ in rows):
+            cluster_index.apply(marker_changes(rows, today))
+            return cluster_index
+    # Позиция журнала читается до меток: изменения, попавшие между двумя
+    # запросами, применятся повторно, но к тому же итогу
+    position = db.session.query(db.func.max(MarkerEvent.id)).scalar() or 0
+    rows = db.session.query(Marker.id, Marker.latitude, Marker.longitude).filter(Marker.deadline >= today)
+    cluster_index.rebuild(rows, built_on=today, position=position)
+    return cluster_index
+
+
+def archive_expired(batch_size=ARCHIVE_BATCH_SIZE, max_batches=None):
+    """Переносит метки с истекшим сроком в marker_archive пачками по batch_size.
+
+    Каждая пачка — отдельная транзакция, так что прерванный перенос можно
+    просто запустить снова. Рейтинг не меняется: строки удаляются мимо ORM
+    и счетчики по местам не уменьшаются.
+    """
+    today = datetime.today().date()
+    columns = [column.name for column in Marker.__table__.columns]
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = [marker_id for marker_id, in db.session.query(Marker.id)
+               .filter(Marker.deadline < today)
+               .order_by(Marker.id)
+               .limit(batch_size)]
+        if not ids:
+            break
+        db.session.execute(MarkerArchive.__table__.insert().from_select(
+            columns,
+            db.select(*Marker.__table__.columns).where(Marker.id.in_(ids))
+        ))
+        db.session.execute(Marker.__table__.delete().where(Marker.id.in_(ids)))
+        bump_data_versions(db.session.connection(), MARKERS_VERSION)
+        db.session.commit()
+        moved += len(ids)
+        batches += 1
+    return moved
+
+
+@app.cli.command('archive-expired')
+@click.option('--batch-size', default=ARCHIVE_BATCH_SIZE, help='Число меток в одной транзакции.')
+def archive_expired_command(batch_size):
+    """Перенести объявления с истекшим сроком в архив."""
+    click.echo(f'archived {archive_expired(batch_size)} markers')
+
+
+def check_cron_secret():
+    # Задачи /tasks/* вызывает Vercel Cron (см. vercel.json) с секретом в заголовке
+    secret = app.config['CRON_SECRET']
+    if not secret:
+        abort(404)
+    if request.headers.get('Authorization') != f'Bearer {secret}':
+        abort(403)
+
+
+@app.route('/tasks/archive-expired')
+def archive_expired_task():
+    # За вызов переносится ограниченное число пачек, чтобы уложиться в лимит времени функции
+    check_cron_secret()
+    moved = archive_expired(max_batches=ARCHIVE_TASK_MAX_BATCHES)
+    return jsonify({'status': 'success', 'archived': moved})
+
+
+def prune_marker_events(days=EVENT_RETENTION_DAYS):
+    # Последнее событие остается всегда: SQLite без AUTOINCREMENT иначе выдал бы
+    # его id следующему событию, и читатели журнала его бы пропустили
+    newest_id = db.session.query(db.func.max(MarkerEvent.id)).scalar()
+    result = db.session.execute(MarkerEvent.__table__.delete().where(
+        MarkerEvent.created_at < datetime.utcnow() - timedelta(days=days), MarkerEvent.id != newest_id))
+    db.session.commit()
+    return result.rowcount
+
+
+@app.cli.command('prune-events')
+@click.option('--days', default=EVENT_RETENTION_DAYS, help='Сколько дней событий оставить.')
+def prune_events_command(days):
+    """Удалить старые события меток из marker_event."""
+    click.echo(f'deleted {prune_marker_events(days)} events')
+
+
+def prune_idempotency_keys(hours=IDEMPOTENCY_KEY_TTL_HOURS):
+    result = db.session.execute(IdempotencyKey.__table__.delete().where(
+        IdempotencyKey.created_at < datetime.utcnow() - timedelta(hours=hours)))
+    db.session.commit()
+    return result.rowcount
+
+
+@app.cli.command('prune-idempotency-keys')
+@click.option('--hours', default=IDEMPOTENCY_KEY_TTL_HOURS, help='Сколько часов ключей оставить.')
+def prune_idempotency_keys_command(hours):
+    """Удалить просроченные ключи идемпотентности."""
+    click.echo(f'deleted {prune_idempotency_keys(hours)} keys')
+
+
+@app.route('/tasks/prune')
+def prune_task():
+    # Одна задача на всю очистку: число заданий Vercel Cron ограничено
+    check_cron_secret()
+    return jsonify({
+        'status': 'success',
+        'events': prune_marker_events(),
+        'idempotency_keys': prune_idempotency_keys(),
+    })
+
+
+def write_import_batch(rows, source, position):
+    # Запись идет мимо ORM, поэтому производные поля и рейтинг считаются здесь,
+    # а позиция в источнике фиксируется в той же транзакции, что и метки
+    now = datetime.utcnow()
+    locations = Counter()
+    for row in rows:
+        row['geohash'] = geohash_encode(row['latitude'], row['longitude'])
+        row['place'] = place_key(row['location_text'])
+        row['created_at'] = row['updated_at'] = now
+        locations[row['location_text']] += 1
+    connection = db.session.connection()
+    with fulltext.bulk_insert(connection):
+        importer.insert_rows(connection, Marker.__table__, rows)
+    by_key = Counter()
+    samples = {}
+    for location_text, count in locations.items():
+        key = location_key(location_text)
+        by_key[key] += count
+        samples.setdefault(key, location_text)
+    for key, count in by_key.items():
+        count_marker(connection, samples[key], now, count)
+    db.session.merge(ImportCheckpoint(source=source, position=position))
+    # Метки пачки не разбираются по тайлам: сбрасываются все тайлы сразу
+    bump_data_versions(connection, MARKERS_VERSION, TILES_VERSION)
+    db.session.commit()
+
+
+def import_markers(records, source, batch_size=IMPORT_BATCH_SIZE, on_error=None, on_batch=None):
+    """Импортирует записи пачками по batch_size, продолжая с сохраненной позиции source.
+
+    Возвращает (imported, skipped). on_error(position, error) вызывается
+    для пропущенных записей, on_batch(position, imported, skipped) — после
+    каждой записанной пачки.
+    """
+    checkpoint = db.session.get(ImportCheckpoint, source)
+    start = checkpoint.position if checkpoint else 0
+    imported = skipped = 0
+    position = start
+    batch = []
+    for index, record in enumerate(records, 1):
+        if index <= start:
+            continue
+        position = index
+        try:
+            batch.append(importer.parse_record(record))
+        except ValueError as e:
+            skipped += 1
+            if on_error:
+                on_error(position, e)
+            continue
+        if len(batch) >= batch_size:
+            write_import_batch(batch, source, position)
+            imported += len(batch)
+            batch = []
+            if on_batch:
+                on_batch(position, imported, skipped)
+    if position > start:
+        write_import_batch(batch, source, position)
+        imported += len(batch)
+        if on_batch:
+            on_batch(position, imported, skipped)
+    if imported:
+        # Отдельных событий для импорта нет: открытые карты перечитываются целиком
+        publish_marker_events([('reset', {})])
+    return imported, skipped
+
+
+@app.cli.command('import-markers')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(importer.FORMATS), help='Формат файла, если не ясен из расширения.')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, help='Число меток в одной транзакции.')
+@click.option('--checkpoint', help='Имя источника для продолжения импорта; по умолчанию путь к файлу.')
+@click.option('--restart', is_flag=True, help='Начать с начала файла, забыв сохраненную позицию.')
+def import_markers_command(path, fmt, batch_size, checkpoint, restart):
+    """Импортировать объявления из CSV, NDJSON или GeoJSON."""
+    fmt = fmt or importer.detect_format(path)
+    source = (checkpoint or os.path.abspath(path))[-255:]
+    if restart:
+        db.session.query(ImportCheckpoint).filter_by(source=source).delete()
+        db.session.commit()
+    started = time.perf_counter()
+
+    def report_error(position, error):
+        click.echo(f'record {position}: {error}', err=True)
+
+    def report_batch(position, imported, skipped):
+        rate = imported / max(time.perf_counter() - started, 1e-9)
+        click.echo(f'{position} records read, {imported} imported, {skipped} skipped ({rate:.0f} rows/s)', err=True)
+
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        imported, skipped = import_markers(importer.read_records(f, fmt), source, batch_size,
+                                           on_error=report_error, on_batch=report_batch)
+    click.echo(f'imported {imported} markers, skipped {skipped}')
+
+
+@app.cli.command('export-markers')
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(exporter.FORMATS), default='ndjson', help='Формат выгрузки.')
+@click.option('-q', '--query', 'q', default='', help='Текст запроса, как в поиске объявлений.')
+@click.option('--all', 'include_expired', is_flag=True, help='Включить объявления с истекшим сроком и архив.')
+@click.option('--bbox', nargs=4, type=float, help='Область: south west north east.')
+def export_markers_command(output, fmt, q, include_expired, bbox):
+    """Выгрузить объявления в NDJSON, CSV или GeoJSON (по умолчанию в stdout)."""
+    count = 0
+
+    def counted(records):
+        nonlocal count
+        for record in records:
+            count += 1
+            yield record
+
+    records = export_records(q.lower(), not include_expired, bbox or None)
+    for chunk in exporter.buffered(exporter.export_chunks(counted(records), fmt)):
+        output.write(chunk)
+    click.echo(f'exported {count} markers', err=True)
+
+
+# Счетчики data_version: первый увеличивает любая запись меток, второй — импорт,
+# после которого устаревают все тайлы; у каждого слота тайлов (TileCache.slot) свой счетчик
+MARKERS_VERSION = 'markers'
+TILES_VERSION = 'tiles'
+
+
+def bump_data_versions(connection, *names):
+    rollups.increment_all(connection, DataVersion.__table__, 'name', names, column='value')
+
+
+def data_versions(*names):
+    # В запросе каждый счетчик читается один раз, чтобы ETag и ключ кэша сверялись с одним значением
+    known = g.setdefault('data_versions', {}) if has_request_context() else {}
+    missing = [name for name in names if name not in known]
+    if missing:
+        found = dict(db.session.query(DataVersion.name, DataVersion.value).filter(DataVersion.name.in_(missing)))
+        for name in missing:
+            known[name] = found.get(name, 0)
+    return tuple(known[name] for name in names)
+
+
+def data_version(name=MARKERS_VERSION):
+    return data_versions(name)[0]
+
+
+page_cache = cache.ResponseCache(cache.create_store(
+    app.config['PAGE_CACHE_BACKEND'],
+    path=app.config['PAGE_CACHE_PATH'],
+    max_entries=app.config['PAGE_CACHE_MAX_ENTRIES'],
+    max_bytes=app.config['PAGE_CACHE_MAX_BYTES'],
+))
+
+
+tile_cache = cache.TileCache(cache.create_store(
+    app.config['PAGE_CACHE_BACKEND'],
+    path=app.config['TILE_CACHE_PATH'],
+    max_entries=app.config['PAGE_CACHE_MAX_ENTRIES'],
+    max_bytes=app.config['PAGE_CACHE_MAX_BYTES'],
+))
+
+
+@contextlib.contextmanager
+def events_connection():
+    # Поток опроса работает вне запросов, поэтому открывает контекст приложения сам
+    with app.app_context(), db.engine.connect() as connection:
+        yield connection
+
+
+marker_events = events.create_broker(
+    app.config['EVENTS_BACKEND'],
+    table=MarkerEvent.__table__,
+    connect=events_connection,
+    interval=app.config['EVENTS_POLL_INTERVAL'],
+    history=EVENT_HISTORY,
+    max_subscribers=app.config['SSE_MAX_CONNECTIONS'],
+)
+
+
+def marker_event(obj, session):
+    if obj in session.new:
+        return 'created', obj.to_dict()
+    if obj in session.deleted:
+        return 'deleted', {'id': obj.id, 'lat': obj.latitude, 'lng': obj.longitude}
+    return 'updated', obj.to_dict()
+
+
+def record_marker_events(connection, items):
+    connection.execute(MarkerEvent.__table__.insert(), [
+        {'type': event_type, 'payload': json.dumps(data, ensure_ascii=False)}
+        for event_type, data in items
+    ])
+
+
+def publish_marker_events(items):
+    """События для записей мимо ORM; ORM-изменения публикуются хуками сессии."""
+    bump_data_versions(db.session.connection(), MARKERS_VERSION)
+    record_marker_events(db.session.connection(), items)
+    db.session.commit()
+    marker_events.committed(items)
+
+
+def marker_positions(marker):
+    """Текущее и, если оно менялось в этом flush, прежнее положение метки."""
+    state = db.inspect(marker)
+    lat_history = state.attrs.latitude.history
+    lng_history = state.attrs.longitude.history
+    positions = {(marker.latitude, marker.longitude)}
+    if lat_history.deleted or lng_history.deleted:
+        positions.add((lat_history.deleted[0] if lat_history.deleted else marker.latitude,
+                       lng_history.deleted[0] if lng_history.deleted else marker.longitude))
+    return positions
+
+
+def touched_tile_slots(positions):
+    return {tile_cache.slot(zoom, *tile_for(lat, lng, zoom))
+            for lat, lng in positions if lat is not None and lng is not None
+            for zoom in range(TILE_MAX_ZOOM + 1)}
+
+
+@event.listens_for(Session, 'after_flush')
+def track_marker_changes(session, flush_context):
+    items = []
+    positions = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Marker):
+            positions.update(marker_positions(obj))
+            items.append(marker_event(obj, session))
+    if items:
+        # Версии данных и журнал событий пишутся в той же транзакции, что и сами метки:
+        # общая версия сбрасывает кэш страниц, версии слотов — только затронутые тайлы.
+        # Строка версии блокируется раньше записи в журнал, поэтому на Postgres id
+        # событий растут в порядке коммитов и читатели журнала не пропускают событий
+        bump_data_versions(session.connection(), MARKERS_VERSION, *touched_tile_slots(positions))
+        record_marker_events(session.connection(), items)
+        session.info.setdefault('marker_events', []).extend(items)
+
+
+@event.listens_for(Session, 'after_commit')
+def publish_committed_events(session):
+    if 'marker_events' in session.info:
+        marker_events.committed(session.info.pop('marker_events'))
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_marker_changes(session):
+    session.info.pop('marker_events', None)
+
 
-CITY_COORDINATES = {
-    # Города Казахстана
-    "алматы": (43.238949, 76.889709),
-    "алмата": (43.238949, 76.889709),
-    "астана": (51.1605, 71.4704),
-    "нур-султан": (51.1605, 71.4704),
-    "нур султан": (51.1605, 71.4704),
-    "шымкент": (42.3417, 69.5901),
-    "караганда": (49.8065, 73.0871),
-    "таразы": (42.9046, 71.3894),
-    "уст-каменогорск": (49.9761, 82.6061),
-    "павлодар": (52.2833, 76.9667),
-    "костанай": (53.222, 63.619),
-    "аттырау": (47.1308, 51.9234),
-    "уральск": (51.2401, 51.2012),
-    "актау": (44.9989, 51.8892),
-
-    # Популярные города России
-    "москва": (55.7558, 37.6176),
-    "санкт-петербург": (59.9311, 30.3609),
-    "новосибирск": (55.0084, 82.9357),
-    "екатеринбург": (56.8389, 60.6057),
-    "казань": (55.8304, 49.0661),
-    "самара": (53.1959, 50.1000),
-    "омск": (54.9893, 73.3682),
-    "челябинск": (55.1644, 61.4368),
-    "ростов-на-дону": (47.2357, 39.7015),
-    "уфа": (54.7388, 55.9721),
-    "волгоград": (48.7080, 44.5133),
-    "краснодар": (45.0443, 38.9760),
-    "воронеж": (51.6615, 39.2003),
-    "нижний новгород": (56.2965, 43.9361),
-    "пермь": (58.0000, 56.2500)
-}
+def cached_page(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Списки активных объявлений зависят от текущей даты
+        key = f'{datetime.today().date()}|{request.full_path}'
+        generation = data_version()
+        hit = page_cache.get(key, generation)
+        if hit is not None:
+            body, mimetype = hit
+            return app.response_class(body, mimetype=mimetype)
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.direct_passthrough:
+            page_cache.set(key, generation, response.get_data(), response.mimetype)
+        return response
+    return wrapper
+
+
+# Версия развертывания входит в ETag, чтобы после выкладки новых шаблонов
+# клиенты не получали 304 на старые страницы
+RELEASE_ID = os.environ.get('VERCEL_GIT_COMMIT_SHA') or datetime.utcnow().isoformat()
+
+if app.config['TEMPLATE_BYTECODE_DIR']:
+    os.makedirs(app.config['TEMPLATE_BYTECODE_DIR'], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_BYTECODE_DIR'])
+app.jinja_env.add_extension(fragments.FragmentCacheExtension)
+if app.config['FRAGMENT_CACHE_MAX_ENTRIES']:
+    # Ключ фрагмента содержит версию записи, поэтому общий для воркеров кэш
+    # не нужен: хватает памяти процесса без инвалидации
+    app.jinja_env.fragment_cache = cache.FragmentCache(
+        cache.MemoryStore(max_entries=app.config['FRAGMENT_CACHE_MAX_ENTRIES']))
+    app.jinja_env.fragment_cache_prefix = RELEASE_ID
+
+
+def make_etag(*parts):
+    return hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()
+
+
+def set_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Хранить можно, но перед использованием ответ нужно сверить с сервером
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    """Ответ 304, если у клиента уже есть актуальная версия, иначе None."""
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        fresh = last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    else:
+        fresh = False
+    if not fresh:
+        return None
+    return set_validators(app.response_class(status=304), etag, last_modified)
+
+
+def conditional(depends_on_markers=True):
+    """Проверка If-None-Match до вызова view, ETag — на успешные ответы."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            parts = [RELEASE_ID, request.full_path]
+            if depends_on_markers:
+                parts += [datetime.today().date(), data_version()]
+            etag = make_etag(*parts)
+            response = not_modified(etag)
+            if response is not None:
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                set_validators(response, etag)
+            return response
+        return wrapper
+    return decorator
+
+
+metrics_registry = metrics.Registry()
+http_requests = metrics_registry.counter(
+    'radar_http_requests_total', 'Запросы по обработчику, методу и статусу.', ('endpoint', 'method', 'status'))
+http_duration = metrics_registry.histogram(
+    'radar_http_request_duration_seconds', 'Время до готового ответа; тело потоковых ответов не входит.',
+    ('endpoint',))
+http_in_flight = metrics_registry.gauge(
+    'radar_http_requests_in_flight', 'Запросы, которые обрабатываются сейчас.', ('endpoint',))
+sql_queries = metrics_registry.counter(
+    'radar_sql_queries_total', 'SQL-запросы по обработчику; вне запросов endpoint="none".', ('endpoint',))
+sql_duration = metrics_registry.histogram(
+    'radar_sql_query_duration_seconds', 'Время выполнения SQL-запросов.',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+requests_refused = metrics_registry.counter(
+    'radar_requests_refused_total', 'Отказы: rate_limit — 429, busy — 503 из-за числа одновременных.', ('reason',))
+pool_acquisitions = metrics_registry.counter(
+    'radar_db_pool_acquisitions_total', 'Получения соединения из пула.')
+pool_acquire_seconds = metrics_registry.counter(
+    'radar_db_pool_acquire_seconds_total', 'Суммарное время ожидания соединения из пула.')
+pool_slow_acquisitions = metrics_registry.counter(
+    'radar_db_pool_slow_acquisitions_total', 'Ожидания соединения дольше DB_SLOW_ACQUIRE_MS.')
+pool_max_acquire_seconds = metrics_registry.gauge(
+    'radar_db_pool_max_acquire_seconds', 'Самое долгое ожидание соединения из пула.')
+pool_checked_out = metrics_registry.gauge(
+    'radar_db_pool_checked_out', 'Соединения, выданные из пула сейчас.')
+sse_subscribers = metrics_registry.gauge(
+    'radar_sse_subscribers', 'Открытые потоки /events.')
+search_in_flight = metrics_registry.gauge(
+    'radar_search_in_flight', 'Поисковые запросы и выгрузки, выполняемые сейчас.')
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_endpoint = request.endpoint or 'none'
+    g.metrics_start = time.perf_counter()
+    http_in_flight.inc(g.metrics_endpoint)
+
+
+# Зарегистрирован раньше сжатия, поэтому выполняется после него и учитывает его время
+@app.after_request
+def record_request_metrics(response):
+    if 'metrics_start' in g:
+        http_requests.inc(g.metrics_endpoint, request.method, str(response.status_code))
+        http_duration.observe(time.perf_counter() - g.metrics_start, g.metrics_endpoint)
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(error):
+    if 'metrics_start' in g:
+        http_in_flight.dec(g.metrics_endpoint)
+
+
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_start = time.perf_counter()
+
+
+def record_query_metrics(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'metrics_start', None)
+    if start is None:
+        return
+    sql_duration.observe(time.perf_counter() - start)
+    sql_queries.inc(g.get('metrics_endpoint', 'none') if has_request_context() else 'none')
+
+
+with app.app_context():
+    event.listen(db.engine, 'before_cursor_execute', start_query_timer)
+    event.listen(db.engine, 'after_cursor_execute', record_query_metrics)
+
+
+@app.route('/metrics')
+def metrics_view():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    stats = dbpool.pool_stats.snapshot()
+    pool_acquisitions.set(value=stats['acquisitions'])
+    pool_acquire_seconds.set(value=stats['total_seconds'])
+    pool_slow_acquisitions.set(value=stats['slow'])
+    pool_max_acquire_seconds.set(value=stats['max_seconds'])
+    checkedout = getattr(db.engine.pool, 'checkedout', None)
+    if checkedout is not None:
+        pool_checked_out.set(value=checkedout())
+    sse_subscribers.set(value=marker_events.subscribers)
+    search_in_flight.set(value=search_gate.in_flight)
+    return app.response_class(metrics_registry.render(), content_type=metrics.Registry.CONTENT_TYPE)
+
+
+static_variants = compression.StaticVariants(app.static_folder)
+
+
+def static_file(filename):
+    # Готовая копия .br/.gz из flask compress-static вместо сжатия на лету
+    variant = static_variants.precompressed(filename, request.accept_encodings)
+    if variant is None:
+        return app.send_static_file(filename)
+    path, encoding = variant
+    response = send_from_directory(app.static_folder, path, mimetype=mimetypes.guess_type(filename)[0],
+                                   max_age=app.get_send_file_max_age(filename))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+app.view_functions['static'] = static_file
+
+
+@app.after_request
+def compress_response(response):
+    if app.config['COMPRESS_RESPONSES']:
+        compression.compress_response(response, request.accept_encodings, app.config['COMPRESS_MIN_SIZE'])
+    return response
+
+
+@app.cli.command('compress-static')
+def compress_static_command():
+    """Записать сжатые копии .br/.gz статических файлов."""
+    results = compression.compress_static(app.static_folder, app.config['COMPRESS_MIN_SIZE'])
+    for filename, encoding, size, compressed in results:
+        click.echo(f'{filename} [{encoding}]: {size} -> {compressed} bytes')
+    if 'br' not in compression.ENCODINGS:
+        click.echo('brotli is not installed, only .gz copies were written')
+
+
+def replay_idempotent(record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return jsonify({'status': 'error', 'error': 'Idempotency-Key was already used with a different request'}), 422
+    if record.status is None:
+        response = jsonify({'status': 'error', 'error': 'a request with this Idempotency-Key is in progress'})
+        response.status_code = 409
+        response.headers['Retry-After'] = '1'
+        return response
+    response = app.response_class(record.body, status=record.status, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """Повтор запроса с тем же заголовком Idempotency-Key возвращает первый ответ.
+
+    Строка ключа добавляется в сессию до вызова view и фиксируется его же
+    коммитом, вместе с записанными метками: параллельный повтор упрется в
+    первичный ключ, а не создаст вторую метку. Ответ дописывается в строку
+    после view. Сохраняются только успешные ответы: после ошибки (4xx, 5xx)
+    ключ освобождается, и запрос можно повторить, в том числе с исправленным телом.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'status': 'error', 'error': 'Idempotency-Key is longer than 255 characters'}), 400
+        digest = hashlib.sha256(f'{request.endpoint}|{key}'.encode()).hexdigest()[:32]
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()[:32]
+        record = db.session.get(IdempotencyKey, digest)
+        if record is not None:
+            if record.created_at >= datetime.utcnow() - timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS):
+                return replay_idempotent(record, fingerprint)
+            db.session.delete(record)
+            db.session.flush()
+        record = IdempotencyKey(key=digest, fingerprint=fingerprint)
+        db.session.add(record)
+        response = make_response(view(*args, **kwargs))
+        if response.status_code >= 400:
+            # Ошибка в запросе или транзакция view не прошла — возможно, ключ уже занят параллельным запросом
+            db.session.rollback()
+            winner = db.session.get(IdempotencyKey, digest)
+            return replay_idempotent(winner, fingerprint) if winner is not None else response
+        record.status = response.status_code
+        record.body = response.get_data(as_text=True)
+        db.session.commit()
+        return response
+    return wrapper
+
+
+ratelimit_backend = ratelimit.create_backend(app.config['RATELIMIT_BACKEND'], path=app.config['RATELIMIT_PATH'])
+write_limit = ratelimit.RateLimiter('write', ratelimit.TokenBucket(WRITE_RATE, WRITE_BURST), ratelimit_backend)
+contact_limit = ratelimit.RateLimiter('contact', ratelimit.SlidingWindow(CONTACT_LIMIT, CONTACT_WINDOW),
+                                      ratelimit_backend)
+search_limit = ratelimit.RateLimiter('search', ratelimit.TokenBucket(SEARCH_RATE, SEARCH_BURST), ratelimit_backend)
+search_gate = ratelimit.ConcurrencyGate(app.config['SEARCH_MAX_CONCURRENCY'])
+
+
+def client_ip():
+    return request.remote_addr or 'unknown'
+
+
+def request_contact():
+    data = request.get_json(silent=True)
+    contact = data.get('contact') if isinstance(data, dict) else None
+    if not isinstance(contact, str):
+        return None
+    return contact.strip().lower() or None
+
+
+def refuse(status, message, retry_after, page):
+    requests_refused.inc('rate_limit' if status == 429 else 'busy')
+    if page:
+        response = make_response(render_template('error.html', error=message), status)
+    else:
+        response = jsonify({'status': 'error', 'error': message})
+        response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def rate_limited(*limits, page=False):
+    """Пределы — пары (RateLimiter, функция ключа); ключ None — предел не применяется."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            for limiter, key in limits:
+                value = key()
+                if value is None:
+                    continue
+                decision = limiter.hit(value)
+                if not decision.allowed:
+                    return refuse(429, 'too many requests, try again later', decision.retry_after, page)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def admitted(gate, page=False):
+    """Сразу отказывает с 503, если gate занят; потоковый ответ держит место до конца."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not gate.acquire():
+                return refuse(503, 'server is busy, try again later', ADMISSION_RETRY_AFTER, page)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                gate.release()
+                raise
+            if response.is_streamed:
+                response.call_on_close(gate.release)
+            else:
+                gate.release()
+            return response
+        return wrapper
+    return decorator
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations', 'versions')
+
+
+def migration_heads():
+    """Последние ревизии в migrations/versions, найденные без импорта Alembic."""
+    revisions = set()
+    parents = set()
+    for name in os.listdir(MIGRATIONS_DIR):
+        if not name.endswith('.py'):
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, name), encoding='utf-8') as f:
+            source = f.read()
+        revisions.update(re.findall(r"^revision = '(\w+)'", source, re.M))
+        for down_revision in re.findall(r'^down_revision = (.+)$', source, re.M):
+            parents.update(re.findall(r"'(\w+)'", down_revision))
+    return revisions - parents
+
+
+def check_schema_revision():
+    # Один запрос к alembic_version вместо проверки каждой таблицы в create_all()
+    try:
+        current = set(db.session.execute(db.text('SELECT version_num FROM alembic_version')).scalars())
+    except exc.SQLAlchemyError:
+        db.session.rollback()
+        current = set()
+    expected = migration_heads()
+    if current != expected:
+        app.logger.error('Database schema is at %s, migrations head is %s: run flask db upgrade',
+                         sorted(current) or 'no revision', sorted(expected))
+    return current == expected
 
 
 @app.before_first_request
-def create_tables():
-    db.create_all()
+def prepare_schema():
+    if app.config['SCHEMA_MODE'] == 'migrations':
+        check_schema_revision()
+    else:
+        db.create_all()
 
 @app.route('/')
 def root():
     return map_view()
 
 
+def parse_radius(value, default):
+    """Радиус в км из параметра запроса, не больше MAX_RADIUS_KM; пустой, нечисловой или не положительный — default."""
+    try:
+        km = float(value)
+    except (TypeError, ValueError):
+        return default
+    if not 0.0 < km < math.inf:
+        return default
+    return min(km, MAX_RADIUS_KM)
+
+
 @app.route('/map')
+@conditional(depends_on_markers=False)
+@cached_page
 def map_view():
-    today = datetime.today().date()
-    markers = Marker.query.filter(Marker.deadline >= today).all()
+    # Метки подгружаются страницей через /api/markers по видимой области карты
+    try:
+        center_lat = float(request.args.get('lat', DEFAULT_CENTER[0]))
+        center_lng = float(request.args.get('lng', DEFAULT_CENTER[1]))
+    except ValueError:
+        center_lat, center_lng = DEFAULT_CENTER
+    # NaN не проходит сравнения и тоже заменяется центром по умолчанию
+    if not (-90.0 <= center_lat <= 90.0 and -180.0 <= center_lng <= 180.0):
+        center_lat, center_lng = DEFAULT_CENTER
+    radius_km = parse_radius(request.args.get('km'), None)
     return render_template('index.html',
-        markers=markers,
-        center_lat=DEFAULT_CENTER[0],
-        center_lng=DEFAULT_CENTER[1])
+        center_lat=center_lat,
+        center_lng=center_lng,
+        radius_km=radius_km,
+        zoom=DEFAULT_ZOOM,
+        tile_max_zoom=TILE_MAX_ZOOM)
+
+
+def parse_bbox(args):
+    south = float(args['south'])
+    west = float(args['west'])
+    north = float(args['north'])
+    east = float(args['east'])
+    if not all(math.isfinite(value) for value in (south, west, north, east)):
+        raise ValueError('bbox coordinates must be finite numbers')
+    if south > north:
+        raise ValueError('south must not be greater than north')
+    south, north = max(south, -90.0), min(north, 90.0)
+    if south > north:
+        raise ValueError('bbox is outside latitudes -90..90')
+    # Leaflet отдает долготы за пределами [-180, 180] при прокрутке карты по кругу
+    if east - west >= 360:
+        west, east = -180.0, 180.0
+    else:
+        west = (west + 180.0) % 360.0 - 180.0
+        east = (east + 180.0) % 360.0 - 180.0
+    return south, west, north, east
+
+
+def geohash_filter(south, west, north, east, model=Marker):
+    ranges = geohash_ranges(south, west, north, east)
+    if ranges is None:
+        return None
+    conds = []
+    for start, stop in ranges:
+        if stop is None:
+            conds.append(model.geohash >= start)
+        else:
+            conds.append((model.geohash >= start) & (model.geohash < stop))
+    return db.or_(*conds)
+
+
+def bbox_filter(south, west, north, east, model=Marker):
+    if west > east:
+        # Область пересекает 180-й меридиан
+        return db.or_(bbox_filter(south, west, north, 180.0, model),
+                      bbox_filter(south, -180.0, north, east, model))
+    cond = model.latitude.between(south, north) & model.longitude.between(west, east)
+    prefilter = geohash_filter(south, west, north, east, model)
+    if prefilter is not None:
+        cond = prefilter & cond
+    return cond
+
+
+@app.route('/api/markers')
+@conditional()
+def markers_in_bbox():
+    try:
+        south, west, north, east = parse_bbox(request.args)
+        zoom = int(request.args.get('zoom', DEFAULT_ZOOM))
+        bbox_cond = bbox_filter(south, west, north, east) if zoom > CLUSTER_MAX_ZOOM else None
+    except (KeyError, ValueError) as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    today = datetime.today().date()
+    clusters = []
+    if zoom <= CLUSTER_MAX_ZOOM:
+        single_ids = []
+        for lat, lng, count, marker_id in get_cluster_index().query(south, west, north, east, zoom):
+            if marker_id is not None:
+                single_ids.append(marker_id)
+            else:
+                clusters.append({'lat': lat, 'lng': lng, 'count': count})
+        # В запрос идут только те id, что могут попасть в ответ: иначе на мелком
+        # масштабе параметров больше, чем допускает SQLite
+        single_ids = sorted(single_ids)[:MAX_MARKERS_PER_RESPONSE + 1]
+        markers_query = Marker.query.filter(Marker.id.in_(single_ids)) if single_ids else None
+    else:
+        markers_query = Marker.query.filter(Marker.deadline >= today, bbox_cond)
+    markers = []
+    if markers_query is not None:
+        markers = markers_query.order_by(Marker.id).limit(MAX_MARKERS_PER_RESPONSE + 1).all()
+    truncated = len(markers) > MAX_MARKERS_PER_RESPONSE
+    return jsonify({
+        'status': 'success',
+        'zoom': zoom,
+        'truncated': truncated,
+        'clusters': clusters,
+        'markers': [m.to_dict() for m in markers[:MAX_MARKERS_PER_RESPONSE]],
+    })
+
+
+def tile_features(zoom, x, y):
+    """Объекты GeoJSON тайла: кластеры до CLUSTER_MAX_ZOOM, дальше — отдельные метки."""
+    features = []
+    if zoom <= CLUSTER_MAX_ZOOM:
+        single_ids = []
+        for lat, lng, count, marker_id in get_cluster_index().query_tile(zoom, x, y):
+            if marker_id is not None:
+                single_ids.append(marker_id)
+            else:
+                features.append({
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': [lng, lat]},
+                    'properties': {'cluster': True, 'count': count},
+                })
+        single_ids = sorted(single_ids)[:MAX_MARKERS_PER_RESPONSE]
+        markers = Marker.query.filter(Marker.id.in_(single_ids)).order_by(Marker.id).all() if single_ids else []
+    else:
+        markers = Marker.query.filter(
+            Marker.deadline >= datetime.today().date(),
+            bbox_filter(*tile_bbox(zoom, x, y))
+        ).order_by(Marker.id).limit(MAX_MARKERS_PER_RESPONSE).all()
+        # Метки на общей границе соседних тайлов отдаются только в одном из них
+        markers = [m for m in markers if tile_for(m.latitude, m.longitude, zoom) == (x, y)]
+    for marker in markers:
+        properties = marker.to_dict()
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [properties.pop('lng'), properties.pop('lat')]},
+            'properties': properties,
+        })
+    return features
+
+
+@app.route('/tiles/<int:zoom>/<int:x>/<int:y>.geojson')
+def marker_tile(zoom, x, y):
+    if not (0 <= zoom <= TILE_MAX_ZOOM and 0 <= x < 1 << zoom and 0 <= y < 1 << zoom):
+        return jsonify({'status': 'error', 'error': 'tile out of range'}), 404
+    today = datetime.today().date()
+    version = data_versions(TILES_VERSION, tile_cache.slot(zoom, x, y))
+    etag = make_etag(RELEASE_ID, today, zoom, x, y, *version)
+    response = not_modified(etag)
+    if response is None:
+        key = f'{today}|{zoom}/{x}/{y}'
+        body = tile_cache.get(key, version)
+        if body is None:
+            body = json.dumps({'type': 'FeatureCollection', 'features': tile_features(zoom, x, y)},
+                              ensure_ascii=False).encode()
+            tile_cache.set(key, version, body)
+        response = app.response_class(body, mimetype='application/geo+json')
+        response.set_etag(etag)
+    # Тайлы кэшируются браузером и CDN так же, как тайлы подложки
+    response.cache_control.public = True
+    response.cache_control.max_age = TILE_MAX_AGE
+    response.cache_control.no_cache = None
+    return response
+
+
+@app.route('/events')
+def marker_events_stream():
+    # Server-Sent Events об изменениях меток; с bbox — только события внутри прямоугольника
+    bbox = None
+    if any(k in request.args for k in ('south', 'west', 'north', 'east')):
+        try:
+            bbox = parse_bbox(request.args)
+        except (KeyError, ValueError) as e:
+            return jsonify({'status': 'error', 'error': str(e)}), 400
+    # Браузер сам шлет Last-Event-ID при переподключении; параметр — для нового EventSource
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return jsonify({'status': 'error', 'error': 'invalid Last-Event-ID'}), 400
+    try:
+        subscription = marker_events.subscribe(last_id)
+    except events.BrokerFull:
+        response = jsonify({'status': 'error', 'error': 'too many event streams'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(SSE_HEARTBEAT_SECONDS)
+        return response
+    max_seconds = app.config['SSE_MAX_SECONDS']
+
+    def stream():
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        deadline = time.monotonic() + max_seconds
+        while time.monotonic() < deadline:
+            batch = subscription.wait(min(SSE_HEARTBEAT_SECONDS, deadline - time.monotonic()))
+            if not batch:
+                yield ': keepalive\n\n'
+                continue
+            for item in batch:
+                if bbox is None or item.type == 'reset' or bbox_contains(bbox, item.data['lat'], item.data['lng']):
+                    yield events.format_event(item)
+
+    response = app.response_class(stream(), mimetype='text/event-stream')
+    # Подписка освобождается и тогда, когда клиент ушел до первого события
+    response.call_on_close(subscription.close)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def markers_within_radius(lat, lng, km, limit):
+    # Сначала отбор по описанному прямоугольнику через индекс geohash,
+    # точное расстояние считается только для попавших в него меток
+    today = datetime.today().date()
+    candidates = Marker.query.filter(
+        Marker.deadline >= today,
+        bbox_filter(*radius_bbox(lat, lng, km))
+    )
+    found = []
+    for marker in candidates:
+        distance = haversine_km(lat, lng, marker.latitude, marker.longitude)
+        if distance <= km:
+            found.append((distance, marker))
+    found.sort(key=lambda x: (x[0], x[1].id))
+    return found[:limit]
+
+
+@app.route('/api/markers/nearby')
+@conditional()
+def markers_nearby():
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        km = float(request.args.get('km', DEFAULT_RADIUS_KM))
+        limit = int(request.args.get('limit', MAX_MARKERS_PER_RESPONSE))
+    except (KeyError, ValueError) as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0):
+        return jsonify({'status': 'error', 'error': 'coordinates out of range'}), 400
+    if not 0.0 < km <= MAX_RADIUS_KM:
+        return jsonify({'status': 'error', 'error': f'km must be between 0 and {MAX_RADIUS_KM}'}), 400
+    limit = min(max(limit, 1), MAX_MARKERS_PER_RESPONSE)
+    markers = []
+    for distance, marker in markers_within_radius(lat, lng, km, limit):
+        item = marker.to_dict()
+        item['distance_km'] = round(distance, 3)
+        markers.append(item)
+    return jsonify({'status': 'success', 'km': km, 'markers': markers})
+
+
+def marker_text(data, key, required=True):
+    value = data[key] if required else data.get(key) or ''
+    if not isinstance(value, str) or (required and not value.strip()):
+        raise ValueError(f'{key} must be a non-empty string' if required else f'{key} must be a string')
+    if len(value) > MAX_MARKER_TEXT:
+        raise ValueError(f'{key} must be at most {MAX_MARKER_TEXT} characters')
+    return value
+
+
+def marker_coordinate(data, key, limit):
+    value = float(data[key])
+    # NaN не проходит ни одно сравнение
+    if not -limit <= value <= limit:
+        raise ValueError(f'{key} must be between {-limit} and {limit}')
+    return value
+
+
+def build_marker(data):
+    """Новая метка из полей запроса; ошибки в полях — KeyError, TypeError, ValueError."""
+    return Marker(
+        help_needed=marker_text(data, 'help_needed'),
+        offer=marker_text(data, 'offer', required=False),
+        location_text=marker_text(data, 'location'),
+        deadline=datetime.strptime(data['deadline'], '%Y-%m-%d').date(),
+        contact=marker_text(data, 'contact'),
+        latitude=marker_coordinate(data, 'lat', 90.0),
+        longitude=marker_coordinate(data, 'lng', 180.0),
+    )
+
+
+def update_marker(marker, data):
+    # Все поля проверяются до изменения, чтобы при ошибке метка осталась нетронутой
+    deadline = datetime.strptime(data['deadline'], '%Y-%m-%d').date()
+    changes = {
+        column: marker_text(data, key, required=key != 'offer')
+        for key, column in (('help_needed', 'help_needed'), ('offer', 'offer'),
+                            ('location', 'location_text'), ('contact', 'contact'))
+        if key in data
+    }
+    for column, value in changes.items():
+        setattr(marker, column, value)
+    marker.deadline = deadline
+
 
 @app.route('/add_marker', methods=['POST'])
+@rate_limited((write_limit, client_ip), (contact_limit, request_contact))
+@idempotent
 def add_marker():
     data = request.get_json()
     try:
-        marker = Marker(
-            help_needed=data['help_needed'],
-            offer=data.get('offer', ''),
-            location_text=data['location'],
-            deadline=datetime.strptime(data['deadline'], '%Y-%m-%d').date(),
-            contact=data['contact'],
-            latitude=float(data['lat']),
-            longitude=float(data['lng']),
-        )
+        marker = build_marker(data)
         db.session.add(marker)
         db.session.commit()
         return jsonify({'status': 'success', 'marker_id': marker.id})
-    except Exception as e:
-        return jsonify({'status': 'error', 'error': str(e)}), 500
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    except Exception:
+        # Текст исключения базы не отдается клиенту
+        db.session.rollback()
+        app.logger.exception('Failed to add marker')
+        return jsonify({'status': 'error', 'error': 'internal error'}), 500
 
 
 @app.route('/edit_marker', methods=['POST'])
+@rate_limited((write_limit, client_ip))
 def edit_marker():
     data = request.get_json()
     try:
         marker = Marker.query.get(int(data['marker_id']))
         if marker:
-            marker.help_needed = data.get('help_needed', marker.help_needed)
-            marker.offer = data.get('offer', marker.offer)
-            marker.location_text = data.get('location', marker.location_text)
-            marker.deadline = datetime.strptime(data['deadline'], '%Y-%m-%d').date()
-            marker.contact = data.get('contact', marker.contact)
+            update_marker(marker, data)
             db.session.commit()
             return jsonify({'status': 'success'})
         return jsonify({'status': 'error', 'error': 'Marker not found'}), 404
-    except Exception as e:
-        return jsonify({'status': 'error', 'error': str(e)}), 500
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    except Exception:
+        db.session.rollback()
+        app.logger.exception('Failed to edit marker')
+        return jsonify({'status': 'error', 'error': 'internal error'}), 500
 
 
 @app.route('/delete_marker', methods=['POST'])
+@rate_limited((write_limit, client_ip))
 def delete_marker():
     data = request.get_json()
     try:
@@ -134,8 +1525,84 @@ def delete_marker():
             db.session.commit()
             return jsonify({'status': 'success'})
         return jsonify({'status': 'error', 'error': 'Marker not found'}), 404
-    except Exception as e:
-        return jsonify({'status': 'error', 'error': str(e)}), 500
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    except Exception:
+        db.session.rollback()
+        app.logger.exception('Failed to delete marker')
+        return jsonify({'status': 'error', 'error': 'internal error'}), 500
+
+
+@app.route('/markers/batch', methods=['POST'])
+@rate_limited((write_limit, client_ip))
+@idempotent
+def markers_batch():
+    """Создание, правка и удаление нескольких меток одной транзакцией.
+
+    Тело: {"operations": [{"op": "create" | "update" | "delete", ...}], "atomic": false}.
+    Поля create и update — как у /add_marker и /edit_marker, update и
+    delete указывают marker_id. Ошибочные операции пропускаются и
+    описываются в results; с atomic=true любая ошибка отменяет весь пакет.
+    """
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'status': 'error', 'error': 'operations must be a non-empty list'}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({'status': 'error', 'error': f'at most {MAX_BATCH_OPERATIONS} operations per batch'}), 400
+    # Все изменяемые метки читаются одним запросом
+    ids = set()
+    for operation in operations:
+        if isinstance(operation, dict) and operation.get('op') in ('update', 'delete'):
+            try:
+                ids.add(int(operation['marker_id']))
+            except (KeyError, TypeError, ValueError):
+                pass
+    markers = {m.id: m for m in Marker.query.filter(Marker.id.in_(ids))} if ids else {}
+    results = []
+    created = []
+    try:
+        for index, operation in enumerate(operations):
+            result = {'index': index, 'status': 'success'}
+            try:
+                if not isinstance(operation, dict):
+                    raise ValueError('operation must be an object')
+                op = operation.get('op')
+                if op == 'create':
+                    marker = build_marker(operation)
+                    db.session.add(marker)
+                    created.append((result, marker))
+                elif op in ('update', 'delete'):
+                    marker = markers.get(int(operation['marker_id']))
+                    if marker is None:
+                        raise LookupError('Marker not found')
+                    result['marker_id'] = marker.id
+                    if op == 'update':
+                        update_marker(marker, operation)
+                    else:
+                        db.session.delete(marker)
+                        del markers[marker.id]
+                else:
+                    raise ValueError(f'unknown op: {op}')
+            except KeyError as e:
+                result = {'index': index, 'status': 'error', 'error': f'{e.args[0]} is required'}
+            except (LookupError, TypeError, ValueError) as e:
+                result = {'index': index, 'status': 'error', 'error': str(e)}
+            results.append(result)
+        failed = sum(result['status'] == 'error' for result in results)
+        if failed and data.get('atomic'):
+            db.session.rollback()
+            return jsonify({'status': 'error', 'error': f'{failed} operations failed', 'results': results}), 400
+        db.session.flush()
+        # id новых меток известны после flush; после коммита объекты устаревают
+        for result, marker in created:
+            result['marker_id'] = marker.id
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        app.logger.exception('Failed to apply marker batch')
+        return jsonify({'status': 'error', 'error': 'internal error'}), 500
+    return jsonify({'status': 'success', 'results': results})
 
 
 @app.route('/about')
@@ -145,49 +1612,216 @@ def about():
 @app.route('/location', methods=['GET', 'POST'])
 def location():
     if request.method == 'POST':
-        city = request.form.get('city', '').strip().lower()
-        coords = CITY_COORDINATES.get(city, DEFAULT_CENTER)
-        return redirect(url_for('map_view'))
-    return render_template('location.html')
+        city = request.form.get('city', '').strip()
+        place = place_index.lookup(city) or get_geocoder().geocode(city)
+        if place is None:
+            return render_template('location.html', default_km=DEFAULT_RADIUS_KM, max_km=MAX_RADIUS_KM,
+                                   city=city, error=f'Город «{city}» не найден'), 404
+        km = parse_radius(request.form.get('km'), DEFAULT_RADIUS_KM)
+        return redirect(url_for('map_view', lat=place.latitude, lng=place.longitude, km=km))
+    return render_template('location.html', default_km=DEFAULT_RADIUS_KM, max_km=MAX_RADIUS_KM)
+
+
+@app.route('/api/geocode')
+def geocode():
+    q = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    return jsonify({
+        'status': 'success',
+        'places': [
+            {'name': m.settlement.name, 'lat': m.settlement.latitude, 'lng': m.settlement.longitude,
+             'country': m.settlement.country, 'score': round(m.score, 3)}
+            for m in get_geocoder().search(q, limit)
+        ],
+    })
 
 @app.route('/rating')
 def rating():
-    location_stats = {}
-    for marker in Marker.query.all():
-        loc = marker.location_text.lower()
-        location_stats[loc] = location_stats.get(loc, 0) + 1
-    top_locations = sorted(location_stats.items(), key=lambda x: x[1], reverse=True)[:100]
-    return render_template('rating.html', top_locations=top_locations)
+    period = request.args.get('period', 'all')
+    if period not in RATING_PERIODS:
+        period = 'all'
+    city = request.args.get('city', '')
+    place = place_index.lookup(city)
+    city = place.name if place else normalize_text(city)
+    days = RATING_PERIODS[period]
+    if days is None:
+        query = db.session.query(LocationCount.location, LocationCount.count)
+        if city:
+            query = query.filter(LocationCount.city == city)
+        query = query.order_by(LocationCount.count.desc(), LocationCount.location)
+    else:
+        total = db.func.sum(LocationDailyCount.count).label('total')
+        query = db.session.query(LocationDailyCount.location, total) \
+            .filter(LocationDailyCount.day > datetime.today().date() - timedelta(days=days))
+        if city:
+            query = query.filter(LocationDailyCount.city == city)
+        query = query.group_by(LocationDailyCount.location) \
+            .order_by(total.desc(), LocationDailyCount.location)
+    top_locations = query.limit(RATING_SIZE).all()
+    return render_template('rating.html', top_locations=top_locations, period=period, city=city)
+
+def listing_query(model, q, active_only):
+    query = model.query
+    if active_only:
+        query = query.filter(model.deadline >= datetime.today().date())
+    rank = None
+    place = place_index.lookup(q) if q else None
+    if place:
+        # Запрос — название места: выборка по индексу канонического места
+        query = query.filter(model.place == place.name)
+    elif q:
+        query, rank = fulltext.search(query, model, db.engine, q)
+    if rank is not None:
+        keys = [(rank, float), (model.id, int)]
+    else:
+        keys = [(model.deadline, date.fromisoformat), (model.id, int)]
+    return query, keys
+
+
+def listing_page(q, active_only):
+    per_page = request.args.get('per_page', type=int) or app.config['ANNOUNCEMENTS_PAGE_SIZE']
+    per_page = min(max(per_page, 1), MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor') or None
+    if active_only:
+        return paginate(*listing_query(Marker, q, active_only), cursor, per_page)
+
+    # История: сначала метки из marker, после них — архив
+    if cursor and cursor.startswith(ARCHIVE_CURSOR_PREFIX):
+        page = paginate(*listing_query(MarkerArchive, q, active_only),
+                        cursor[len(ARCHIVE_CURSOR_PREFIX):] or None, per_page)
+        return Page(page.items, page.next_cursor and ARCHIVE_CURSOR_PREFIX + page.next_cursor)
+    page = paginate(*listing_query(Marker, q, active_only), cursor, per_page)
+    if page.next_cursor:
+        return page
+    archive_query, archive_keys = listing_query(MarkerArchive, q, active_only)
+    room = per_page - len(page.items)
+    if not room:
+        return Page(page.items, ARCHIVE_CURSOR_PREFIX if archive_query.first() is not None else None)
+    archived = paginate(archive_query, archive_keys, None, room)
+    return Page(page.items + archived.items,
+                archived.next_cursor and ARCHIVE_CURSOR_PREFIX + archived.next_cursor)
+
 
 @app.route('/search')
+@rate_limited((search_limit, client_ip), page=True)
+@conditional()
+@cached_page
+@admitted(search_gate, page=True)
 def search():
-    q = request.args.get('q', '')
+    q = request.args.get('q', '').lower()
     markers_found = []
+    next_cursor = None
     if q:
-        q = q.lower()
-        markers_found = Marker.query.filter(
-            (Marker.location_text.ilike(f'%{q}%')) | (Marker.help_needed.ilike(f'%{q}%'))
-        ).all()
-    return render_template('search.html', q=q, markers_found=markers_found)
+        try:
+            markers_found, next_cursor = listing_page(q, active_only=False)
+        except ValueError as e:
+            return render_template('error.html', error=str(e)), 400
+    return render_template('search.html', q=q, markers_found=markers_found, next_cursor=next_cursor)
 
 @app.route('/announcements')
+@rate_limited((search_limit, client_ip), page=True)
+@conditional()
+@cached_page
+@admitted(search_gate, page=True)
 def announcements():
-    q = request.args.get('q', '')
-    today = datetime.today().date()
-    current_markers = Marker.query.filter(Marker.deadline >= today)
-    if q:
-        q = q.lower()
-        current_markers = current_markers.filter(
-            (Marker.location_text.ilike(f'%{q}%')) | (Marker.help_needed.ilike(f'%{q}%'))
-        )
-    return render_template('announcements.html', markers=current_markers.all(), query=q)
+    q = request.args.get('q', '').lower()
+    try:
+        markers, next_cursor = listing_page(q, active_only=True)
+    except ValueError as e:
+        return render_template('error.html', error=str(e)), 400
+    return render_template('announcements.html', markers=markers, query=q, next_cursor=next_cursor)
+
+
+@app.route('/api/search')
+@rate_limited((search_limit, client_ip))
+@conditional()
+@admitted(search_gate)
+def api_search():
+    return api_listing(active_only=False)
+
+
+@app.route('/api/announcements')
+@rate_limited((search_limit, client_ip))
+@conditional()
+@admitted(search_gate)
+def api_announcements():
+    return api_listing(active_only=True)
+
+
+def api_listing(active_only):
+    q = request.args.get('q', '').lower()
+    if not q and not active_only:
+        return jsonify({'status': 'success', 'markers': [], 'next_cursor': None})
+    try:
+        markers, next_cursor = listing_page(q, active_only)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    return jsonify({
+        'status': 'success',
+        'markers': [m.to_dict() for m in markers],
+        'next_cursor': next_cursor,
+    })
+
+def export_records(q='', active_only=True, bbox=None):
+    """Записи для выгрузки в порядке id; без active_only — вместе с архивом.
+
+    Запросы строятся сразу, и ошибки в параметрах (ValueError) возникают
+    при вызове, а не посреди уже начатого потокового ответа.
+    """
+    queries = []
+    for model in (Marker,) if active_only else (Marker, MarkerArchive):
+        query, _ = listing_query(model, q, active_only)
+        if bbox:
+            query = query.filter(bbox_filter(*bbox, model=model))
+        queries.append(query.with_entities(
+            model.id, model.help_needed, model.offer, model.location_text, model.place,
+            model.deadline, model.contact, model.latitude, model.longitude,
+        ).order_by(model.id))
+    # Только нужные столбцы и серверный курсор (yield_per): память не растет с размером выгрузки
+    return (dict(zip(exporter.FIELDS, row)) for query in queries for row in query.yield_per(EXPORT_BATCH_SIZE))
+
+
+@app.route('/api/export/<fmt>')
+@rate_limited((search_limit, client_ip))
+@conditional()
+@admitted(search_gate)
+def export(fmt):
+    if fmt not in exporter.FORMATS:
+        return jsonify({'status': 'error', 'error': f'unknown format: {fmt}'}), 404
+    q = request.args.get('q', '').lower()
+    active_only = request.args.get('active', '1') != '0'
+    bbox = None
+    try:
+        if any(k in request.args for k in ('south', 'west', 'north', 'east')):
+            bbox = parse_bbox(request.args)
+        records = export_records(q, active_only, bbox)
+    except (KeyError, ValueError) as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    chunks = exporter.export_chunks(records, fmt)
+    return app.response_class(
+        stream_with_context(exporter.buffered(chunks)),
+        mimetype=exporter.MIMETYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename=markers.{fmt}'},
+    )
+
 
 @app.route('/announcement/<int:marker_id>')
 def announcement(marker_id):
-    marker = Marker.query.get(marker_id)
-    if marker:
-        return render_template('announcement.html', marker=marker)
-    return redirect(url_for('map_view'))
+    # Валидаторы проверяются по одной колонке, до загрузки объявления и рендеринга
+    for model in (Marker, MarkerArchive):
+        row = db.session.query(model.updated_at).filter(model.id == marker_id).first()
+        if row is not None:
+            break
+    else:
+        return redirect(url_for('map_view'))
+    updated_at = row.updated_at
+    etag = make_etag(RELEASE_ID, marker_id, updated_at.isoformat() if updated_at else '')
+    response = not_modified(etag, updated_at)
+    if response is not None:
+        return response
+    marker = db.session.get(model, marker_id)
+    response = make_response(render_template('announcement.html', marker=marker))
+    return set_validators(response, etag, updated_at)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,201 @@
+"""Кэш готовых ответов с версионированием по поколению данных.
+
+Ключ записи включает номер поколения данных, который приложение читает из
+базы (таблица data_version) и увеличивает в той же транзакции, что и запись
+меток. После записи в любом процессе старые записи перестают находиться во
+всех процессах и со временем вытесняются по LRU. Хранилища:
+
+- MemoryStore — словарь в памяти процесса с ограничением по числу
+  записей и суммарному размеру;
+- SQLiteStore — файл SQLite, общий для всех воркеров gunicorn на одной
+  машине: страница, отрисованная одним воркером, достается и остальным.
+
+Так же устроен TileCache, только версия у каждого тайла своя.
+"""
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+class MemoryStore:
+    def __init__(self, max_entries=512, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += len(value)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteStore:
+    # Время последнего обращения обновляется не чаще, чем раз в столько секунд
+    TOUCH_INTERVAL = 30
+
+    def __init__(self, path, max_entries=4096, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                         'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_entries_accessed ON entries (accessed)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute('SELECT value, accessed FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > self.TOUCH_INTERVAL:
+            conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+                     (key, value, len(value), time.time()))
+        count, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        if count > self.max_entries or size > self.max_bytes:
+            self._evict(conn, count, size)
+
+    def _evict(self, conn, count, size):
+        # Вытесняется с запасом в 10%, чтобы не чистить кэш на каждой записи
+        target_count = int(self.max_entries * 0.9)
+        target_size = int(self.max_bytes * 0.9)
+        for key, entry_size in conn.execute('SELECT key, size FROM entries ORDER BY accessed').fetchall():
+            if count <= target_count and size <= target_size:
+                break
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            count -= 1
+            size -= entry_size
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+
+class NullStore:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class ResponseCache:
+    def __init__(self, store):
+        self.store = store
+
+    def _key(self, key, generation):
+        return f'{generation}:{key}'
+
+    def get(self, key, generation):
+        """(body, mimetype) для key в поколении generation или None."""
+        value = self.store.get(self._key(key, generation))
+        if value is None:
+            return None
+        mimetype, _, body = value.partition(b'\n')
+        return body, mimetype.decode()
+
+    def set(self, key, generation, body, mimetype):
+        self.store.set(self._key(key, generation), mimetype.encode() + b'\n' + body)
+
+
+class TileCache:
+    """Готовые тайлы карты с инвалидацией только затронутых тайлов.
+
+    Версия тайла — пара (поколение всех тайлов, счетчик слота), где слот
+    выбирается по хешу координат из SLOTS штук: так число счетчиков не
+    растет с числом тайлов, а запись метки заодно сбрасывает лишь немногие
+    соседние по слоту тайлы. Счетчики хранит и увеличивает приложение,
+    здесь только имена слотов и ключи.
+    """
+    SLOTS = 4096
+
+    def __init__(self, store):
+        self.store = store
+
+    @classmethod
+    def slot(cls, zoom, x, y):
+        return f'tile:{zlib.crc32(f"{zoom}/{x}/{y}".encode()) % cls.SLOTS}'
+
+    def _key(self, key, version):
+        return '{}.{}:{}'.format(*version, key)
+
+    def get(self, key, version):
+        return self.store.get(self._key(key, version))
+
+    def set(self, key, version, body):
+        self.store.set(self._key(key, version), body)
+
+
+class FragmentCache:
+    """Готовые куски HTML для тега {% cache %} в шаблонах.
+
+    Версия данных входит в сам ключ фрагмента, поэтому инвалидация не
+    нужна; ttl лишь ограничивает срок жизни, 0 или None — без срока.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, key):
+        value = self.store.get(key)
+        if value is None:
+            return None
+        expires, _, body = value.partition(b'\n')
+        if expires and float(expires) < time.time():
+            return None
+        return body.decode()
+
+    def set(self, key, body, ttl=None):
+        expires = str(time.time() + ttl) if ttl else ''
+        self.store.set(key, expires.encode() + b'\n' + body.encode())
+
+
+def create_store(backend, path=None, max_entries=None, max_bytes=None):
+    limits = {k: v for k, v in (('max_entries', max_entries), ('max_bytes', max_bytes)) if v}
+    if backend == 'memory':
+        return MemoryStore(**limits)
+    if backend == 'sqlite':
+        return SQLiteStore(path, **limits)
+    if backend == 'none':
+        return NullStore()
+    raise ValueError(f'unknown cache backend: {backend}')
@@ -0,0 +1,173 @@
+"""Сеточная кластеризация меток по уровням масштаба карты.
+
+Для каждого уровня масштаба от min_zoom до max_zoom карта в проекции
+Web Mercator делится на квадратные ячейки размером cell_size пикселей.
+Ячейка хранит число меток, сумму их координат (для центра кластера) и
+идентификаторы. Индекс обновляется поштучно изменениями из журнала, поэтому
+запрос кластеров не требует пересчета.
+"""
+import threading
+
+from geo import TILE_SIZE, lnglat_to_world
+
+
+class _Cell:
+    __slots__ = ('count', 'lat_sum', 'lng_sum', 'ids')
+
+    def __init__(self):
+        self.count = 0
+        self.lat_sum = 0.0
+        self.lng_sum = 0.0
+        self.ids = set()
+
+
+class GridClusterIndex:
+    def __init__(self, min_zoom=0, max_zoom=13, cell_size=64):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.cell_size = cell_size
+        self.built_on = None
+        # Позиция в журнале изменений, до которой включительно изменения уже в индексе
+        self.position = 0
+        self._lock = threading.Lock()
+        self._points = {}
+        self._levels = {z: {} for z in range(min_zoom, max_zoom + 1)}
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell_key(self, lat, lng, zoom):
+        x, y = lnglat_to_world(lat, lng, zoom)
+        n = self._grid_size(zoom)
+        return min(int(x // self.cell_size), n - 1), min(int(y // self.cell_size), n - 1)
+
+    def _grid_size(self, zoom):
+        return max(1, TILE_SIZE * (1 << zoom) // self.cell_size)
+
+    def _insert(self, marker_id, lat, lng):
+        self._points[marker_id] = (lat, lng)
+        for zoom, cells in self._levels.items():
+            key = self._cell_key(lat, lng, zoom)
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = _Cell()
+            cell.count += 1
+            cell.lat_sum += lat
+            cell.lng_sum += lng
+            cell.ids.add(marker_id)
+
+    def _discard(self, marker_id):
+        point = self._points.pop(marker_id, None)
+        if point is None:
+            return
+        lat, lng = point
+        for zoom, cells in self._levels.items():
+            key = self._cell_key(lat, lng, zoom)
+            cell = cells[key]
+            cell.count -= 1
+            cell.lat_sum -= lat
+            cell.lng_sum -= lng
+            cell.ids.discard(marker_id)
+            if cell.count == 0:
+                del cells[key]
+
+    def rebuild(self, points, built_on=None, position=0):
+        """Заполняет индекс заново из итерируемого (id, lat, lng).
+
+        position — позиция журнала изменений, которую набор точек уже учитывает.
+        """
+        with self._lock:
+            self._points = {}
+            self._levels = {z: {} for z in self._levels}
+            for marker_id, lat, lng in points:
+                self._insert(marker_id, lat, lng)
+            self.built_on = built_on
+            self.position = position
+
+    def apply(self, changes):
+        """Применяет изменения журнала — тройки (позиция, id, (lat, lng) или None).
+
+        None удаляет метку. Изменения с позицией не дальше уже примененной
+        пропускаются, поэтому потоки, прочитавшие журнал одновременно, могут
+        применять его независимо.
+        """
+        with self._lock:
+            for position, marker_id, point in changes:
+                if position <= self.position:
+                    continue
+                self._discard(marker_id)
+                if point is not None:
+                    self._insert(marker_id, *point)
+                self.position = position
+
+    def add(self, marker_id, lat, lng):
+        with self._lock:
+            self._discard(marker_id)
+            self._insert(marker_id, lat, lng)
+
+    def remove(self, marker_id):
+        with self._lock:
+            self._discard(marker_id)
+
+    def _x_ranges(self, west, east, zoom):
+        n = self._grid_size(zoom)
+        x0 = min(int(lnglat_to_world(0.0, west, zoom)[0] // self.cell_size), n - 1)
+        x1 = min(int(lnglat_to_world(0.0, east, zoom)[0] // self.cell_size), n - 1)
+        if west <= east:
+            return [(x0, x1)]
+        # Область пересекает 180-й меридиан
+        return [(x0, n - 1), (0, x1)]
+
+    def query(self, south, west, north, east, zoom):
+        """Кластеры в области для уровня масштаба zoom.
+
+        Возвращает список кортежей (lat, lng, count, marker_id), где
+        lat/lng — центр масс меток ячейки, а marker_id заполнен только для
+        ячеек с единственной меткой. Уровни за пределами индекса приводятся
+        к ближайшему существующему.
+        """
+        zoom = max(self.min_zoom, min(self.max_zoom, zoom))
+        _, y0 = lnglat_to_world(north, 0.0, zoom)
+        _, y1 = lnglat_to_world(south, 0.0, zoom)
+        n = self._grid_size(zoom)
+        y0 = min(int(y0 // self.cell_size), n - 1)
+        y1 = min(int(y1 // self.cell_size), n - 1)
+        x_ranges = self._x_ranges(west, east, zoom)
+
+        with self._lock:
+            cells = self._levels[zoom]
+            span = sum(x1 - x0 + 1 for x0, x1 in x_ranges) * (y1 - y0 + 1)
+            if span < len(cells):
+                keys = ((x, y) for x0, x1 in x_ranges
+                        for x in range(x0, x1 + 1)
+                        for y in range(y0, y1 + 1))
+                found = [cells[key] for key in keys if key in cells]
+            else:
+                found = [
+                    cell for key, cell in cells.items()
+                    if y0 <= key[1] <= y1
+                    and any(x0 <= key[0] <= x1 for x0, x1 in x_ranges)
+                ]
+            return self._clusters(found)
+
+    def query_tile(self, zoom, x, y):
+        """Кластеры ячеек, лежащих в тайле (x, y) уровня zoom, в формате query().
+
+        Ячейки не пересекают границ тайлов (cell_size делит TILE_SIZE),
+        поэтому каждый кластер попадает ровно в один тайл.
+        """
+        per_tile = TILE_SIZE // self.cell_size
+        keys = [(cx, cy) for cx in range(x * per_tile, (x + 1) * per_tile)
+                for cy in range(y * per_tile, (y + 1) * per_tile)]
+        with self._lock:
+            cells = self._levels[zoom]
+            return self._clusters([cells[key] for key in keys if key in cells])
+
+    @staticmethod
+    def _clusters(cells):
+        return [
+            (cell.lat_sum / cell.count, cell.lng_sum / cell.count,
+             cell.count, next(iter(cell.ids)) if cell.count == 1 else None)
+            for cell in cells
+        ]
+
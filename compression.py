@@ -0,0 +1,192 @@
+"""Сжатие ответов gzip и brotli.
+
+compress_response сжимает ответ, если клиент принимает сжатие, тип
+содержимого есть в COMPRESSIBLE_TYPES и тело не короче min_size байт.
+Потоковые ответы (выгрузки, файлы) сжимаются по кускам, не собирая тело в
+памяти. Brotli доступен, только если установлен пакет brotli.
+
+compress_static заранее пишет рядом со статическими файлами копии .br и
+.gz с максимальной степенью сжатия и манифест с хэшами исходников.
+StaticVariants находит копию, которую можно отдать вместо файла: по хэшу,
+а не по mtime, потому что после git checkout времена файлов произвольны.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = frozenset([
+    'text/html',
+    'text/css',
+    'text/csv',
+    'text/plain',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'application/geo+json',
+    'application/x-ndjson',
+    'application/xml',
+    'image/svg+xml',
+])
+# Порядок — предпочтение сервера при одинаковом q у клиента
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+# Готовые копии не требуют модуля brotli для отдачи
+STATIC_ENCODINGS = ('br', 'gzip')
+EXTENSIONS = {'br': '.br', 'gzip': '.gz'}
+MANIFEST = '.precompressed.json'
+
+# Ответы сжимаются на лету, поэтому уровни — компромисс со временем CPU
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+
+def compressible(mimetype):
+    return mimetype in COMPRESSIBLE_TYPES
+
+
+def compress(data, encoding, level=None):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY if level is None else level)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL if level is None else level, mtime=0)
+
+
+def compress_chunks(chunks, encoding):
+    """Сжимает поток; каждый кусок сбрасывается клиенту сразу."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+        return
+    # wbits=31 — формат gzip
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def compress_response(response, accept_encodings, min_size):
+    """Сжимает ответ Flask на месте, если это имеет смысл."""
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return response
+    if 'Content-Encoding' in response.headers or not compressible(response.mimetype):
+        return response
+    # Кэши между клиентом и сервером должны хранить варианты раздельно
+    response.vary.add('Accept-Encoding')
+    encoding = accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encoding)
+        response.direct_passthrough = False
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        compressed = compress(data, encoding)
+        if len(compressed) >= len(data):
+            return response
+        response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # Сжатое тело отличается побайтно, но по смыслу то же: ETag становится слабым
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def _digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def compress_static(folder, min_size):
+    """Пишет копии .br/.gz для файлов folder; возвращает (файл, кодировка, было, стало)."""
+    results = []
+    manifest = {}
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if name == MANIFEST or os.path.splitext(name)[1] in EXTENSIONS.values():
+                continue
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, folder).replace(os.sep, '/')
+            if not compressible(mimetypes.guess_type(name)[0]):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            written = []
+            for encoding in STATIC_ENCODINGS:
+                target = path + EXTENSIONS[encoding]
+                if encoding == 'br' and brotli is None:
+                    continue
+                compressed = compress(data, encoding, level=11 if encoding == 'br' else 9)
+                if len(data) < min_size or len(compressed) >= len(data):
+                    if os.path.exists(target):
+                        os.remove(target)
+                    continue
+                with open(target, 'wb') as f:
+                    f.write(compressed)
+                written.append(encoding)
+                results.append((filename, encoding, len(data), len(compressed)))
+            if written:
+                manifest[filename] = {'sha1': hashlib.sha1(data).hexdigest(), 'encodings': written}
+    with open(os.path.join(folder, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return results
+
+
+class StaticVariants:
+    """Готовые сжатые копии статики из манифеста compress_static."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._manifest = None
+        # (файл, mtime, размер) -> кодировки актуальных копий
+        self._fresh = {}
+
+    def _load(self):
+        if self._manifest is None:
+            try:
+                with open(os.path.join(self.folder, MANIFEST)) as f:
+                    self._manifest = json.load(f)
+            except (OSError, ValueError):
+                self._manifest = {}
+        return self._manifest
+
+    def encodings(self, filename):
+        entry = self._load().get(filename)
+        if entry is None:
+            return ()
+        path = os.path.join(self.folder, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return ()
+        key = (filename, stat.st_mtime, stat.st_size)
+        if key not in self._fresh:
+            # Исходник правили после сборки — копии устарели
+            fresh = _digest(path) == entry['sha1']
+            self._fresh[key] = tuple(entry['encodings']) if fresh else ()
+        return self._fresh[key]
+
+    def precompressed(self, filename, accept_encodings):
+        """(имя копии, кодировка) для лучшей принимаемой клиентом кодировки или None."""
+        encodings = self.encodings(filename)
+        if not encodings:
+            return None
+        encoding = accept_encodings.best_match([e for e in STATIC_ENCODINGS if e in encodings])
+        if encoding is None:
+            return None
+        return filename + EXTENSIONS[encoding], encoding
@@ -0,0 +1,138 @@
+"""Настройка пула соединений с базой из переменных окружения.
+
+Режимы пула (DB_POOL_MODE):
+
+- queue — обычный QueuePool SQLAlchemy с ограничением размера, переполнения
+  и времени жизни соединений;
+- null — NullPool: соединение открывается на каждый checkout и сразу
+  закрывается. Для работы через внешний пулер (pgbouncer в режиме
+  transaction), который сам держит соединения с Postgres.
+
+Время получения соединения из пула (вместе с открытием нового, если
+свободных нет) записывается в pool_stats; слишком долгие ожидания
+попадают в лог.
+"""
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+POOL_MODES = ('queue', 'null')
+
+PoolSettings = namedtuple('PoolSettings', [
+    'mode', 'size', 'max_overflow', 'timeout', 'recycle', 'pre_ping', 'statement_timeout_ms', 'slow_acquire_ms',
+])
+
+
+def _flag(value):
+    return value.strip().lower() not in ('', '0', 'false', 'no', 'off')
+
+
+def settings_from_env(environ=os.environ):
+    mode = environ.get('DB_POOL_MODE', 'queue')
+    if mode not in POOL_MODES:
+        raise ValueError(f'DB_POOL_MODE must be one of {", ".join(POOL_MODES)}, got {mode!r}')
+    return PoolSettings(
+        mode=mode,
+        size=int(environ.get('DB_POOL_SIZE', 5)),
+        max_overflow=int(environ.get('DB_MAX_OVERFLOW', 10)),
+        timeout=float(environ.get('DB_POOL_TIMEOUT', 10)),
+        # Соединения старше этого (в секундах) переоткрываются, пока их не закрыл сервер
+        recycle=int(environ.get('DB_POOL_RECYCLE', 1800)),
+        pre_ping=_flag(environ.get('DB_POOL_PRE_PING', '1')),
+        statement_timeout_ms=int(environ.get('DB_STATEMENT_TIMEOUT_MS', 0)),
+        slow_acquire_ms=float(environ.get('DB_SLOW_ACQUIRE_MS', 100)),
+    )
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.slow = 0
+        self.slow_threshold = 0.1
+
+    def record(self, seconds):
+        with self._lock:
+            self.acquisitions += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            if seconds >= self.slow_threshold:
+                self.slow += 1
+        if seconds >= self.slow_threshold:
+            logger.warning('Waited %.0f ms for a database connection', seconds * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'acquisitions': self.acquisitions,
+                'total_seconds': self.total_seconds,
+                'max_seconds': self.max_seconds,
+                'slow': self.slow,
+            }
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.record(time.perf_counter() - start)
+
+
+class TimedNullPool(NullPool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.record(time.perf_counter() - start)
+
+
+def engine_options(url, settings):
+    """Параметры create_engine для SQLALCHEMY_ENGINE_OPTIONS.
+
+    SQLite остается на настройках Flask-SQLAlchemy по умолчанию.
+    """
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite':
+        return {}
+    pool_stats.slow_threshold = settings.slow_acquire_ms / 1000
+    if settings.mode == 'null':
+        options = {'poolclass': TimedNullPool}
+    else:
+        options = {
+            'poolclass': TimedQueuePool,
+            'pool_size': settings.size,
+            'max_overflow': settings.max_overflow,
+            'pool_timeout': settings.timeout,
+            'pool_recycle': settings.recycle,
+            'pool_pre_ping': settings.pre_ping,
+        }
+        if settings.statement_timeout_ms and url.get_backend_name() == 'postgresql':
+            # Таймаут задается при подключении; через pgbouncer так нельзя, см. install()
+            options['connect_args'] = {'options': f'-c statement_timeout={settings.statement_timeout_ms}'}
+    return options
+
+
+def install(engine, settings):
+    """Обработчики событий, которые нельзя передать через параметры create_engine."""
+    if settings.mode == 'null' and settings.statement_timeout_ms and engine.dialect.name == 'postgresql':
+        # pgbouncer в режиме transaction отдает каждую транзакцию любому серверному
+        # соединению, поэтому таймаут ставится в начале каждой транзакции
+        @event.listens_for(engine, 'begin')
+        def set_statement_timeout(conn):
+            conn.exec_driver_sql(f'SET LOCAL statement_timeout = {settings.statement_timeout_ms:d}')
@@ -0,0 +1,181 @@
+"""Рассылка событий об изменении меток подписчикам /events (SSE).
+
+Брокеры:
+
+- LocalBroker — события живут в памяти процесса и публикуются после
+  коммита. Подходит для одного процесса и для тестов;
+- DatabaseBroker — один поток на процесс раз в interval секунд читает
+  новые строки журнала событий и раздает их локальным подписчикам. Журнал
+  пишет приложение в той же транзакции, что и изменение меток, так что
+  события видят все воркеры gunicorn и все экземпляры функции, пока жив
+  хоть один подписчик. Поток полагается на то, что id событий растут в
+  порядке коммитов: на Postgres приложение для этого берет блокировку
+  строки версии данных до записи событий.
+
+Последние history событий хранятся в памяти: переподключившийся клиент
+получает пропущенное по Last-Event-ID, а если его позиция старше буфера —
+событие reset, после которого он перечитывает карту целиком.
+
+Число подписчиков процесса ограничено max_subscribers: каждый поток SSE
+держит поток воркера, и без предела соединения заняли бы их все.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple('Event', ['id', 'type', 'data'])
+
+
+class BrokerFull(Exception):
+    """Достигнут предел подписчиков процесса."""
+
+
+def format_event(event):
+    return f'id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event.data, ensure_ascii=False)}\n\n'
+
+
+class Subscription:
+    def __init__(self, broker, cursor):
+        self.broker = broker
+        self.cursor = cursor
+        self._closed = False
+
+    def wait(self, timeout):
+        """События после курсора; если их нет, ждет до timeout секунд."""
+        events = self.broker.wait(self.cursor, timeout)
+        if events:
+            self.cursor = events[-1].id
+        return events
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.broker.unsubscribe()
+
+
+class LocalBroker:
+    def __init__(self, history=1024, max_subscribers=16):
+        self.max_subscribers = max_subscribers
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=history)
+        self._last_id = 0
+        # События с id не больше этого могли не попасть в буфер
+        self._floor = 0
+        self._subscribers = 0
+
+    def committed(self, items):
+        """Вызывается после коммита изменения; items — пары (тип, данные)."""
+        with self._cond:
+            for event_type, data in items:
+                self._last_id += 1
+                self._append(Event(self._last_id, event_type, data))
+            self._cond.notify_all()
+
+    def _append(self, event):
+        if len(self._events) == self._events.maxlen:
+            self._floor = self._events[0].id
+        self._events.append(event)
+
+    def _start(self):
+        pass
+
+    def subscribe(self, last_id=None):
+        with self._cond:
+            if self._subscribers >= self.max_subscribers:
+                raise BrokerFull()
+            self._subscribers += 1
+        try:
+            self._start()
+        except Exception:
+            self.unsubscribe()
+            raise
+        return Subscription(self, self._last_id if last_id is None else last_id)
+
+    def unsubscribe(self):
+        with self._cond:
+            self._subscribers -= 1
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    def _after(self, cursor):
+        if cursor < self._floor or cursor > self._last_id:
+            # Пропущенных событий уже нет в буфере (или курсор из другой базы)
+            return [Event(self._last_id, 'reset', {})]
+        return [e for e in self._events if e.id > cursor]
+
+    def wait(self, cursor, timeout):
+        with self._cond:
+            if cursor == self._last_id:
+                self._cond.wait(timeout)
+            return self._after(cursor)
+
+
+class DatabaseBroker(LocalBroker):
+    def __init__(self, table, connect, interval=1.0, batch_size=500, **kwargs):
+        super().__init__(**kwargs)
+        self.table = table
+        # connect() — контекстный менеджер, отдающий соединение SQLAlchemy
+        self.connect = connect
+        self.interval = interval
+        self.batch_size = batch_size
+        self._thread = None
+
+    def committed(self, items):
+        # Строки придут через опрос таблицы, как и события других процессов
+        pass
+
+    def _start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            with self.connect() as connection:
+                latest = connection.execute(self.table.select().with_only_columns(
+                    self.table.c.id).order_by(self.table.c.id.desc()).limit(1)).scalar()
+            self._last_id = self._floor = latest or 0
+            self._events.clear()
+            self._thread = threading.Thread(target=self._poll, name='marker-events', daemon=True)
+            self._thread.start()
+
+    def _fetch(self):
+        with self.connect() as connection:
+            rows = connection.execute(
+                self.table.select().where(self.table.c.id > self._last_id)
+                .order_by(self.table.c.id).limit(self.batch_size)
+            ).all()
+        return [Event(row.id, row.type, json.loads(row.payload)) for row in rows]
+
+    def _poll(self):
+        while True:
+            with self._cond:
+                if self._subscribers == 0:
+                    # Без подписчиков база не опрашивается; следующий subscribe
+                    # запустит поток заново с текущей позиции
+                    self._thread = None
+                    return
+            try:
+                events = self._fetch()
+            except Exception:
+                logger.exception('Failed to poll marker events')
+                events = []
+            if events:
+                with self._cond:
+                    for event in events:
+                        self._append(event)
+                    self._last_id = events[-1].id
+                    self._cond.notify_all()
+            if len(events) < self.batch_size:
+                time.sleep(self.interval)
+
+
+def create_broker(backend, table=None, connect=None, interval=1.0, history=1024, max_subscribers=16):
+    if backend == 'local':
+        return LocalBroker(history=history, max_subscribers=max_subscribers)
+    if backend == 'database':
+        return DatabaseBroker(table, connect, interval=interval, history=history, max_subscribers=max_subscribers)
+    raise ValueError(f'unknown events backend: {backend}')
@@ -0,0 +1,93 @@
+"""Потоковая выгрузка объявлений в NDJSON, CSV и GeoJSON.
+
+Форматтеры принимают итератор словарей (поля как в Marker.to_dict) и
+отдают текст кусками, по строке на запись, поэтому выгрузка любого
+размера занимает постоянную память и первые байты уходят клиенту сразу.
+Поля совпадают с форматом команды import-markers, так что выгрузку можно
+загрузить обратно.
+"""
+import csv
+import io
+import json
+from datetime import date
+
+FIELDS = ['id', 'help_needed', 'offer', 'location', 'place', 'deadline', 'contact', 'lat', 'lng']
+MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'geojson': 'application/geo+json',
+}
+FORMATS = tuple(MIMETYPES)
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, default=_json_default)
+
+
+def ndjson_chunks(records):
+    for record in records:
+        yield _dumps(record) + '\n'
+
+
+def csv_chunks(records):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def geojson_chunks(records):
+    yield '{"type": "FeatureCollection", "features": [\n'
+    separator = ''
+    for record in records:
+        properties = {k: v for k, v in record.items() if k not in ('lat', 'lng')}
+        feature = {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [record['lng'], record['lat']]},
+            'properties': properties,
+        }
+        yield separator + _dumps(feature)
+        separator = ',\n'
+    yield '\n]}\n'
+
+
+FORMATTERS = {
+    'ndjson': ndjson_chunks,
+    'csv': csv_chunks,
+    'geojson': geojson_chunks,
+}
+
+
+def export_chunks(records, fmt):
+    return FORMATTERS[fmt](records)
+
+
+def buffered(chunks, size=64 * 1024):
+    """Склеивает мелкие куски до size символов; первый кусок отдается сразу."""
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return
+    yield first
+    parts = []
+    length = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(parts)
+            parts = []
+            length = 0
+    if parts:
+        yield ''.join(parts)
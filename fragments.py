@@ -0,0 +1,54 @@
+"""Тег {% cache key, ttl %} для кэширования кусков шаблонов.
+
+    {% cache ('announcement-item', marker.id, marker.updated_at), 86400 %}
+      ...
+    {% endcache %}
+
+Ключ — любое выражение; в полный ключ добавляются имя шаблона и строка
+тега, так что одинаковые ключи в разных местах не пересекаются. В ключ
+нужно включать все, от чего зависит содержимое: обычно id и время
+изменения записи. ttl в секундах необязателен.
+
+Хранилище задается атрибутом окружения fragment_cache (cache.FragmentCache);
+пока он None, тег просто выводит содержимое.
+"""
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+def _key_part(value):
+    if isinstance(value, (tuple, list)):
+        return '|'.join(map(str, value))
+    return str(value)
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        # Префикс ключей — версия развертывания, чтобы не отдавать фрагменты старых шаблонов
+        environment.extend(fragment_cache=None, fragment_cache_prefix='')
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [nodes.Const(f'{parser.name}:{lineno}'), parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', args), [], [], body).set_lineno(lineno)
+
+    def _render(self, location, key, ttl, caller):
+        fragments = self.environment.fragment_cache
+        if fragments is None:
+            return caller()
+        key = f'{self.environment.fragment_cache_prefix}|{location}|{_key_part(key)}'
+        body = fragments.get(key)
+        if body is None:
+            body = caller()
+            fragments.set(key, body, ttl)
+        # Содержимое уже экранировано при первом рендере
+        return Markup(body)
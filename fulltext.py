@@ -0,0 +1,169 @@
+"""Полнотекстовый поиск по объявлениям.
+
+На Postgres используется выражение to_tsvector с конфигурацией russian и
+GIN-индекс по нему, на SQLite — внешняя таблица FTS5, которую триггеры
+синхронизируют с marker. Архив marker_archive индексируется так же. Для остальных СУБД (и для базы, где индекс еще
+не создан миграцией) остается поиск через ILIKE.
+"""
+import re
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+
+PG_CONFIG = 'russian'
+
+
+def postgres_ddl(table):
+    return [
+        f"CREATE INDEX IF NOT EXISTS ix_{table}_fts ON {table} USING gin "
+        "(to_tsvector('russian'::regconfig, location_text || ' ' || help_needed))",
+    ]
+
+
+def postgres_drop_ddl(table):
+    return [f"DROP INDEX IF EXISTS ix_{table}_fts"]
+
+
+def sqlite_ddl(table):
+    fts = f'{table}_fts'
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"location_text, help_needed, content='{table}', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, location_text, help_needed) "
+        "VALUES (new.id, new.location_text, new.help_needed); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, location_text, help_needed) "
+        "VALUES ('delete', old.id, old.location_text, old.help_needed); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF location_text, help_needed ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, location_text, help_needed) "
+        "VALUES ('delete', old.id, old.location_text, old.help_needed); "
+        f"INSERT INTO {fts}(rowid, location_text, help_needed) "
+        "VALUES (new.id, new.location_text, new.help_needed); END",
+    ]
+
+
+def sqlite_rebuild_ddl(table):
+    return f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')"
+
+
+def sqlite_drop_ddl(table):
+    fts = f'{table}_fts'
+    return [
+        f"DROP TRIGGER IF EXISTS {fts}_au",
+        f"DROP TRIGGER IF EXISTS {fts}_ad",
+        f"DROP TRIGGER IF EXISTS {fts}_ai",
+        f"DROP TABLE IF EXISTS {fts}",
+    ]
+
+
+# Индекс таблицы marker; архив индексируется так же (см. register)
+SQLITE_FTS_TABLE = 'marker_fts'
+POSTGRES_DDL = postgres_ddl('marker')
+POSTGRES_DROP_DDL = postgres_drop_ddl('marker')
+SQLITE_DDL = sqlite_ddl('marker')
+SQLITE_REBUILD_DDL = sqlite_rebuild_ddl('marker')
+SQLITE_INSERT_TRIGGER = 'marker_fts_ai'
+SQLITE_DROP_DDL = sqlite_drop_ddl('marker')
+
+_available = {}
+_indexed_tables = set()
+
+
+def register(table):
+    """Создавать индекс вместе с таблицей при db.create_all()."""
+    _indexed_tables.add(table.name)
+    for statement in postgres_ddl(table.name):
+        sa.event.listen(table, 'after_create', sa.DDL(statement).execute_if(dialect='postgresql'))
+    for statement in sqlite_ddl(table.name):
+        sa.event.listen(table, 'after_create', sa.DDL(statement).execute_if(dialect='sqlite'))
+
+
+def include_name(name, type_, parent_names):
+    """Фильтр для autogenerate: таблицы FTS5 создаются миграцией вручную."""
+    return not (type_ == 'table' and re.search(r'_fts(_|$)', name))
+
+
+def is_available(engine, table='marker'):
+    key = engine.url, table
+    if key not in _available:
+        if engine.dialect.name == 'postgresql':
+            _available[key] = True
+        elif engine.dialect.name == 'sqlite':
+            with engine.connect() as conn:
+                _available[key] = conn.execute(
+                    sa.text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+                    {'name': f'{table}_fts'}
+                ).first() is not None
+        else:
+            _available[key] = False
+    return _available[key]
+
+
+@contextmanager
+def bulk_insert(connection):
+    """Пачка вставок в marker с одним обновлением индекса в конце.
+
+    На SQLite построчный триггер FTS5 в несколько раз медленнее самой
+    вставки, поэтому на время пачки он удаляется, а новые строки попадают в
+    индекс одним INSERT ... SELECT. Все это — внутри транзакции пачки, так
+    что при откате триггер возвращается вместе с ней.
+    """
+    if connection.dialect.name != 'sqlite' or not is_available(connection.engine):
+        yield
+        return
+    if not connection.connection.driver_connection.in_transaction:
+        # pysqlite сам открывает транзакцию только перед DML, а DDL ниже должен откатываться
+        connection.exec_driver_sql('BEGIN')
+    last_id = connection.execute(sa.text('SELECT coalesce(max(id), 0) FROM marker')).scalar()
+    connection.exec_driver_sql(f'DROP TRIGGER {SQLITE_INSERT_TRIGGER}')
+    yield
+    connection.execute(sa.text(
+        f'INSERT INTO {SQLITE_FTS_TABLE}(rowid, location_text, help_needed) '
+        'SELECT id, location_text, help_needed FROM marker WHERE id > :last_id'
+    ), {'last_id': last_id})
+    connection.exec_driver_sql(next(ddl for ddl in SQLITE_DDL if SQLITE_INSERT_TRIGGER in ddl))
+
+
+def tokenize(q):
+    return re.findall(r'\w+', q.lower())
+
+
+def search(query, model, engine, q):
+    """Ограничивает query совпадениями с q.
+
+    Возвращает пару (query, rank), где rank — выражение релевантности,
+    по возрастанию которого результаты идут от лучших к худшим, или None,
+    если полнотекстовый индекс таблицы недоступен.
+    """
+    table = model.__table__.name
+    words = tokenize(q)
+    if not words:
+        return query.filter(sa.false()), None
+    if table not in _indexed_tables or not is_available(engine, table):
+        pattern = f'%{q.lower()}%'
+        return query.filter(model.location_text.ilike(pattern) | model.help_needed.ilike(pattern)), None
+
+    if engine.dialect.name == 'postgresql':
+        # Выражение должно совпадать с выражением индекса ix_<таблица>_fts
+        document = sa.func.to_tsvector(
+            sa.literal_column(f"'{PG_CONFIG}'::regconfig"),
+            model.location_text.op('||')(sa.literal_column("' '")).op('||')(model.help_needed)
+        )
+        tsquery = sa.func.to_tsquery(
+            sa.literal_column(f"'{PG_CONFIG}'::regconfig"),
+            ' & '.join(f'{w}:*' for w in words)
+        )
+        # ts_rank возвращает real: без приведения значение из курсора страницы
+        # (float8) не совпадает с ним при сравнении и строки на границе страниц
+        # повторяются или теряются
+        rank = sa.cast(-sa.func.ts_rank(document, tsquery), sa.Float(precision=53))
+        return query.filter(document.op('@@')(tsquery)), rank
+
+    fts_table = f'{table}_fts'
+    fts = sa.table(fts_table, sa.column('rowid'))
+    match = ' '.join(f'"{w}"*' for w in words)
+    query = query.join(fts, fts.c.rowid == model.id) \
+        .filter(sa.literal_column(fts_table).op('MATCH')(match))
+    return query, sa.func.bm25(sa.literal_column(fts_table))
@@ -0,0 +1,175 @@
+"""Геометрические функции для работы с координатами меток."""
+import math
+
+TILE_SIZE = 256
+# Широта, за которой проекция Web Mercator уходит в бесконечность
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def lnglat_to_world(lat, lng, zoom):
+    """Пиксельные координаты точки на карте Web Mercator заданного масштаба."""
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    scale = TILE_SIZE * (1 << zoom)
+    x = (lng + 180.0) / 360.0 * scale
+    sin_lat = math.sin(math.radians(lat))
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale
+    return x, y
+
+
+def tile_for(lat, lng, zoom):
+    """Координаты (x, y) тайла уровня zoom, в который попадает точка."""
+    x, y = lnglat_to_world(lat, lng, zoom)
+    n = 1 << zoom
+    return min(int(x // TILE_SIZE), n - 1), min(int(y // TILE_SIZE), n - 1)
+
+
+def tile_bbox(zoom, x, y):
+    """Границы тайла (south, west, north, east) в градусах.
+
+    Крайние ряды тайлов продолжаются до полюсов: точки за пределами
+    проекции Web Mercator попадают в них, как и в tile_for().
+    """
+    n = 1 << zoom
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = 90.0 if y == 0 else math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = -90.0 if y == n - 1 else math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+# Не больше стольких ячеек geohash на одну прямоугольную область запроса
+MAX_GEOHASH_CELLS = 32
+
+
+def geohash_encode(lat, lng, precision=GEOHASH_PRECISION):
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                bits = bits * 2 + 1
+                lng_lo = mid
+            else:
+                bits = bits * 2
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                bits = bits * 2 + 1
+                lat_lo = mid
+            else:
+                bits = bits * 2
+                lat_hi = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """Высота и ширина ячейки geohash в градусах."""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def _geohash_cover(south, west, north, east, precision):
+    height, width = geohash_cell_size(precision)
+    rows = int((north + 90.0) // height) - int((south + 90.0) // height) + 1
+    cols = int((east + 180.0) // width) - int((west + 180.0) // width) + 1
+    if rows * cols > MAX_GEOHASH_CELLS:
+        return None
+    lat0 = (south + 90.0) // height * height - 90.0
+    lng0 = (west + 180.0) // width * width - 180.0
+    cells = set()
+    for i in range(rows):
+        lat = min(lat0 + (i + 0.5) * height, 90.0)
+        for j in range(cols):
+            lng = min(lng0 + (j + 0.5) * width, 180.0)
+            cells.add(geohash_encode(lat, lng, precision))
+    return sorted(cells)
+
+
+def _geohash_successor(prefix):
+    """Наименьшая строка, большая всех geohash с данным префиксом."""
+    prefix = prefix.rstrip(GEOHASH_ALPHABET[-1])
+    if not prefix:
+        return None
+    return prefix[:-1] + GEOHASH_ALPHABET[GEOHASH_ALPHABET.index(prefix[-1]) + 1]
+
+
+def geohash_ranges(south, west, north, east):
+    """Диапазоны [start, stop) значений geohash, покрывающие область.
+
+    Область не должна пересекать 180-й меридиан. Возвращает None, если
+    область настолько велика, что фильтр по geohash ничего не отсекает.
+    """
+    cells = None
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        cells = _geohash_cover(south, west, north, east, precision)
+        if cells is not None:
+            break
+    if cells is None or (len(cells[0]) == 1 and len(cells) >= len(GEOHASH_ALPHABET) // 2):
+        return None
+    # Соседние по алфавиту ячейки сливаются в один диапазон
+    ranges = []
+    for cell in cells:
+        stop = _geohash_successor(cell)
+        if ranges and ranges[-1][1] == cell:
+            ranges[-1][1] = stop
+        else:
+            ranges.append([cell, stop])
+    return [(start, stop) for start, stop in ranges]
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Расстояние по большому кругу между двумя точками в километрах."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bbox(lat, lng, km):
+    """Прямоугольник (south, west, north, east), содержащий круг радиуса km.
+
+    Долготы нормализуются в [-180, 180], поэтому при пересечении 180-го
+    меридиана west окажется больше east.
+    """
+    dlat = math.degrees(km / EARTH_RADIUS_KM)
+    south, north = lat - dlat, lat + dlat
+    if south <= -90.0 or north >= 90.0:
+        # Круг накрывает полюс — по долготе ограничений нет
+        return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+    dlng = math.degrees(math.asin(min(1.0, math.sin(km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+    if dlng >= 180.0:
+        return south, -180.0, north, 180.0
+    west = (lng - dlng + 180.0) % 360.0 - 180.0
+    east = (lng + dlng + 180.0) % 360.0 - 180.0
+    return south, west, north, east
+
+
+def bbox_contains(bbox, lat, lng):
+    """Попадает ли точка в прямоугольник; west > east — прямоугольник через 180-й меридиан."""
+    south, west, north, east = bbox
+    if not south <= lat <= north:
+        return False
+    if west <= east:
+        return west <= lng <= east
+    return lng >= west or lng <= east
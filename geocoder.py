@@ -0,0 +1,254 @@
+"""Офлайн-геокодер населенных пунктов с нечетким поиском.
+
+Справочник (data/gazetteer.tsv) загружается в память один раз. Поиск по
+префиксу идет двоичным поиском по отсортированному списку ключей, нечеткий
+поиск — по индексу триграмм: кандидаты набираются из списков триграмм
+запроса, все достаточно близкие из них дополнительно сравниваются по
+расстоянию редактирования (чтобы находить перестановки букв вроде
+'аламты'), при
+равенстве оценок выше стоит более населенный пункт.
+
+Формат справочника — строки, разделенные табуляцией:
+name, lat, lng, population, country, aliases (через запятую).
+Файл можно собрать из выгрузок GeoNames командой flask build-gazetteer.
+"""
+import bisect
+import math
+import os
+from collections import Counter, namedtuple
+from itertools import chain
+
+from places import alias_key
+
+GAZETTEER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gazetteer.tsv')
+
+# Минимальное сходство по триграммам, при котором нечеткое совпадение принимается
+FUZZY_THRESHOLD = 0.4
+# Сколько ключей просматривается при поиске по очень короткому префиксу
+PREFIX_SCAN_LIMIT = 1000
+# Опечатки длиннее стольких правок расстоянием редактирования не ищутся
+MAX_EDIT_DISTANCE = 2
+# Запросы короче этого ищутся только по префиксу
+MIN_FUZZY_LENGTH = 3
+# Коды стран СНГ, которые попадают в справочник из выгрузок GeoNames
+CIS_COUNTRIES = ('KZ', 'RU', 'KG', 'UZ', 'TJ', 'TM', 'BY', 'AM', 'AZ', 'MD', 'UA', 'GE')
+
+# Русские буквы и их латинская запись: по ней из кириллических синонимов GeoNames
+# выбирается русское название, если в выгрузке нет названий с isolanguage=ru
+RUSSIAN_LETTERS = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+TRANSLIT = dict(zip(RUSSIAN_LETTERS, [
+    'a', 'b', 'v', 'g', 'd', 'e', 'e', 'zh', 'z', 'i', 'y', 'k', 'l', 'm', 'n', 'o', 'p', 'r', 's', 't', 'u', 'f',
+    'kh', 'ts', 'ch', 'sh', 'shch', '', 'y', '', 'e', 'yu', 'ya',
+]))
+
+Settlement = namedtuple('Settlement', ['name', 'latitude', 'longitude', 'population', 'country'])
+Match = namedtuple('Match', ['settlement', 'score'])
+
+
+def trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, max_distance):
+    """Расстояние Левенштейна с учетом перестановки соседних букв.
+
+    Если расстояние больше max_distance, возвращается max_distance + 1.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > max_distance:
+            return max_distance + 1
+        prev2, prev = prev, cur
+    return prev[len(b)]
+
+
+class Geocoder:
+    def __init__(self):
+        self.settlements = []
+        self._keys = []
+        self._key_owner = []
+        self._key_trigrams = []
+        self._trigram_index = {}
+        self._sorted_keys = []
+        self._sorted = True
+
+    def add(self, settlement, aliases=()):
+        owner = len(self.settlements)
+        self.settlements.append(settlement)
+        for name in {alias_key(a) for a in (settlement.name, *aliases)}:
+            if not name:
+                continue
+            key_id = len(self._keys)
+            self._keys.append(name)
+            self._key_owner.append(owner)
+            grams = trigrams(name)
+            self._key_trigrams.append(len(grams))
+            for gram in grams:
+                self._trigram_index.setdefault(gram, []).append(key_id)
+            self._sorted_keys.append((name, key_id))
+            self._sorted = False
+
+    def load(self, path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip() or line.startswith('#'):
+                    continue
+                name, lat, lng, population, country, aliases = (line.rstrip('\n').split('\t') + [''] * 6)[:6]
+                self.add(
+                    Settlement(name, float(lat), float(lng), int(population or 0), country),
+                    [a for a in aliases.split(',') if a]
+                )
+        return self
+
+    def _prefix(self, key):
+        if not self._sorted:
+            self._sorted_keys.sort()
+            self._sorted = True
+        found = {}
+        start = bisect.bisect_left(self._sorted_keys, (key, -1))
+        for name, key_id in self._sorted_keys[start:start + PREFIX_SCAN_LIMIT]:
+            if not name.startswith(key):
+                break
+            owner = self._key_owner[key_id]
+            score = 1.0 if name == key else 0.9
+            if score > found.get(owner, 0.0):
+                found[owner] = score
+        return found
+
+    def _fuzzy(self, key):
+        grams = trigrams(key)
+        shared = Counter(chain.from_iterable(self._trigram_index.get(gram, ()) for gram in grams))
+        # Сходство по Жаккару не меньше порога только при таком числе общих триграмм
+        min_common = math.ceil(FUZZY_THRESHOLD * len(grams))
+        found = {}
+        for key_id, common in shared.items():
+            if common < min_common:
+                continue
+            score = common / (len(grams) + self._key_trigrams[key_id] - common)
+            owner = self._key_owner[key_id]
+            if score >= FUZZY_THRESHOLD and score > found.get(owner, 0.0):
+                found[owner] = score
+        # Расстояние редактирования считается для всех ключей с min_common общими
+        # триграммами, а не для части из них: иначе результат зависел бы от порядка
+        # обхода при равном числе общих триграмм. Ключи другой длины заведомо дальше
+        for key_id, common in shared.items():
+            name = self._keys[key_id]
+            if common < min_common or abs(len(name) - len(key)) > MAX_EDIT_DISTANCE:
+                continue
+            distance = edit_distance(key, name, MAX_EDIT_DISTANCE)
+            if distance > MAX_EDIT_DISTANCE:
+                continue
+            score = 1.0 - distance / max(len(key), len(name))
+            owner = self._key_owner[key_id]
+            if score >= FUZZY_THRESHOLD and score > found.get(owner, 0.0):
+                found[owner] = score
+        return found
+
+    def search(self, query, limit=10):
+        """Населенные пункты, подходящие к query, от лучших к худшим."""
+        key = alias_key(query)
+        if not key:
+            return []
+        found = self._prefix(key)
+        if len(found) < limit and len(key) >= MIN_FUZZY_LENGTH:
+            for owner, score in self._fuzzy(key).items():
+                # Нечеткое совпадение всегда ниже точного и префиксного
+                score = min(score, 0.85)
+                if score > found.get(owner, 0.0):
+                    found[owner] = score
+        ranked = sorted(found.items(),
+                        key=lambda x: (-x[1], -self.settlements[x[0]].population, self.settlements[x[0]].name))
+        return [Match(self.settlements[owner], score) for owner, score in ranked[:limit]]
+
+    def geocode(self, query):
+        """Лучшее совпадение для query или None."""
+        matches = self.search(query, limit=1)
+        return matches[0].settlement if matches else None
+
+
+def read_russian_names(path):
+    """Русские названия из выгрузки альтернативных названий GeoNames (alternateNamesV2.txt, alternatenames/KZ.txt).
+
+    Возвращает словарь geonameid -> название с isolanguage=ru; разговорные и
+    исторические названия пропускаются, помеченное основным (isPreferredName) важнее.
+    """
+    names = {}
+    preferred = set()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            cols = line.rstrip('\n').split('\t')
+            if len(cols) < 8 or cols[2] != 'ru' or cols[6] == '1' or cols[7] == '1':
+                continue
+            geonameid = cols[1]
+            if geonameid in preferred:
+                continue
+            if cols[4] == '1':
+                preferred.add(geonameid)
+                names[geonameid] = cols[3]
+            else:
+                names.setdefault(geonameid, cols[3])
+    return names
+
+
+def russian_alias(aliases, ascii_name):
+    """Синоним, записанный только русскими буквами, ближе всех к ascii_name в транслитерации."""
+    target = ''.join(ch for ch in ascii_name.lower() if ch.isalpha())
+    best = None
+    for alias in aliases:
+        letters = [ch for ch in alias.lower() if ch.isalpha()]
+        if not letters or any(ch not in TRANSLIT for ch in letters):
+            continue
+        latin = ''.join(TRANSLIT[ch] for ch in letters)
+        distance = edit_distance(latin, target, len(latin) + len(target))
+        if best is None or distance < best[0]:
+            best = distance, alias
+    return best[1] if best else None
+
+
+def read_geonames(path, min_population=0, countries=CIS_COUNTRIES, russian_names=None):
+    """Населенные пункты из выгрузки GeoNames (cities500.txt, KZ.txt и т. п.).
+
+    Название — русское из russian_names (см. read_russian_names), без него —
+    кириллический синоним (записанный русскими буквами, если такой есть, см.
+    russian_alias), и лишь затем ASCII-название GeoNames; остальные названия
+    становятся синонимами.
+    """
+    russian_names = russian_names or {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            cols = line.rstrip('\n').split('\t')
+            if len(cols) < 15 or cols[6] != 'P' or cols[8] not in countries:
+                continue
+            population = int(cols[14] or 0)
+            if population < min_population:
+                continue
+            # Из альтернативных названий оставляются кириллические: по ним ищут пользователи
+            cyrillic = [a for a in cols[3].split(',') if a and any('а' <= ch.lower() <= 'я' for ch in a)]
+            name = (russian_names.get(cols[0]) or russian_alias(cyrillic, cols[2] or cols[1])
+                    or next(iter(cyrillic), None) or cols[2] or cols[1])
+            aliases = [a for a in dict.fromkeys([cols[1], cols[2], *cyrillic]) if a and a != name]
+            yield Settlement(name, float(cols[4]), float(cols[5]), population, cols[8]), aliases
+
+
+def write_gazetteer(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('# name\tlat\tlng\tpopulation\tcountry\taliases\n')
+        count = 0
+        for settlement, aliases in rows:
+            f.write('\t'.join([
+                settlement.name.replace('\t', ' '), f'{settlement.latitude:.5f}', f'{settlement.longitude:.5f}',
+                str(settlement.population), settlement.country,
+                ','.join(a.replace(',', ' ').replace('\t', ' ') for a in aliases),
+            ]) + '\n')
+            count += 1
+    return count
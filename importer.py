@@ -0,0 +1,234 @@
+"""Потоковое чтение и проверка объявлений для массового импорта.
+
+Поддерживаются CSV с заголовком, NDJSON (один объект на строку) и GeoJSON:
+FeatureCollection разбирается по одному объекту из массива features, не
+загружая весь файл в память, GeoJSONSeq читается построчно. Поля записей
+называются так же, как в JSON запроса /add_marker: help_needed, offer,
+location, deadline, contact, lat, lng; у объектов GeoJSON координаты
+берутся из геометрии Point, остальные поля — из properties.
+
+На Postgres строки записываются через COPY, на остальных СУБД — одним
+executemany на пачку.
+"""
+import csv
+import io
+import json
+import os
+import re
+from datetime import date
+
+FORMATS = ('csv', 'ndjson', 'geojson')
+EXTENSIONS = {
+    '.csv': 'csv',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.geojson': 'geojson',
+    '.geojsonl': 'geojson',
+    '.json': 'geojson',
+}
+MAX_TEXT_LENGTH = 255
+READ_CHUNK_SIZE = 1 << 16
+
+FEATURES_START = re.compile(r'"features"\s*:\s*\[')
+ARRAY_SEPARATOR = re.compile(r'[\s,]*')
+DATE_FORMAT = re.compile(r'\d{4}-\d{2}-\d{2}$')
+
+
+class RecordError(ValueError):
+    """Запись, которую не удалось разобрать; читатели отдают ее вместо записи."""
+
+
+def detect_format(path):
+    fmt = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f'cannot detect format of {path}, pass --format')
+    return fmt
+
+
+def read_csv(f):
+    yield from csv.DictReader(f)
+
+
+def read_ndjson(f):
+    for line in f:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield RecordError(f'invalid JSON: {e}')
+
+
+def _feature_record(feature):
+    if not isinstance(feature, dict):
+        return RecordError('feature must be an object')
+    geometry = feature.get('geometry') or {}
+    coordinates = geometry.get('coordinates')
+    if geometry.get('type') != 'Point' or not isinstance(coordinates, list) or len(coordinates) < 2:
+        return RecordError('geometry must be a Point')
+    record = dict(feature.get('properties') or {})
+    record['lng'], record['lat'] = coordinates[:2]
+    return record
+
+
+def _iter_json_array(f, buffer):
+    """Элементы JSON-массива, открывающая скобка которого уже прочитана."""
+    decoder = json.JSONDecoder()
+    pos = 0
+    while True:
+        pos = ARRAY_SEPARATOR.match(buffer, pos).end()
+        if pos == len(buffer):
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                raise ValueError('unexpected end of file')
+            buffer, pos = chunk, 0
+            continue
+        if buffer[pos] == ']':
+            return
+        try:
+            value, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Элемент не поместился в буфер целиком — дочитываем файл
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                raise
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield value
+
+
+def _is_feature(line):
+    try:
+        value = json.loads(line)
+    except json.JSONDecodeError:
+        return False
+    return isinstance(value, dict) and value.get('type') == 'Feature'
+
+
+def _lines(head, f):
+    lines = head.split('\n')
+    tail = lines.pop()
+    yield from lines
+    for line in f:
+        yield tail + line
+        tail = ''
+    yield tail
+
+
+def read_geojson(f):
+    head = f.read(READ_CHUNK_SIZE)
+    if _is_feature(head.lstrip().lstrip('\x1e').split('\n', 1)[0]):
+        # GeoJSONSeq: по объекту Feature на строку, возможно с разделителем RS
+        for line in _lines(head, f):
+            line = line.strip().lstrip('\x1e')
+            if not line:
+                continue
+            try:
+                yield _feature_record(json.loads(line))
+            except json.JSONDecodeError as e:
+                yield RecordError(f'invalid JSON: {e}')
+        return
+    match = FEATURES_START.search(head)
+    while match is None:
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            raise ValueError('no "features" array found')
+        head += chunk
+        match = FEATURES_START.search(head)
+    for feature in _iter_json_array(f, head[match.end():]):
+        yield _feature_record(feature)
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+    'geojson': read_geojson,
+}
+
+
+def read_records(f, fmt):
+    """Записи файла f в виде словарей.
+
+    Неразборчивая запись отдается как RecordError, чтобы импорт мог ее
+    пропустить; ошибка в структуре всего файла прерывает чтение.
+    """
+    return READERS[fmt](f)
+
+
+def _text(record, name, required=True):
+    value = record.get(name)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f'{name} is required')
+    if len(value) > MAX_TEXT_LENGTH:
+        raise ValueError(f'{name} is longer than {MAX_TEXT_LENGTH} characters')
+    return value
+
+
+def parse_record(record):
+    """Значения столбцов marker для записи или ValueError с причиной."""
+    if isinstance(record, RecordError):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError('record must be an object')
+    deadline = _text(record, 'deadline')
+    if not DATE_FORMAT.match(deadline):
+        raise ValueError('deadline must be YYYY-MM-DD')
+    try:
+        deadline = date.fromisoformat(deadline)
+    except ValueError as e:
+        raise ValueError(f'deadline: {e}')
+    try:
+        latitude = float(record['lat'])
+        longitude = float(record['lng'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('lat and lng must be numbers')
+    if not (-90.0 <= latitude <= 90.0 and -180.0 <= longitude <= 180.0):
+        raise ValueError('coordinates out of range')
+    return {
+        'help_needed': _text(record, 'help_needed'),
+        'offer': _text(record, 'offer', required=False),
+        'location_text': _text(record, 'location'),
+        'deadline': deadline,
+        'contact': _text(record, 'contact'),
+        'latitude': latitude,
+        'longitude': longitude,
+    }
+
+
+def _copy_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def copy_rows(connection, table, rows):
+    """COPY ... FROM STDIN для psycopg2 и psycopg 3."""
+    columns = list(rows[0])
+    # Пустые значения этих столбцов — NULL (пустых строк в них не бывает)
+    null_columns = [c for c in columns if any(row[c] is None for row in rows)]
+    buffer = io.StringIO()
+    # QUOTE_ALL: пустая строка остается пустой строкой, а не NULL
+    writer = csv.writer(buffer, quoting=csv.QUOTE_ALL)
+    for row in rows:
+        writer.writerow([_copy_value(row[c]) for c in columns])
+    buffer.seek(0)
+    options = 'FORMAT csv'
+    if null_columns:
+        options += f', FORCE_NULL ({", ".join(null_columns)})'
+    sql = f'COPY {table.name} ({", ".join(columns)}) FROM STDIN WITH ({options})'
+    cursor = connection.connection.driver_connection.cursor()
+    try:
+        if hasattr(cursor, 'copy_expert'):
+            cursor.copy_expert(sql, buffer)
+        else:
+            with cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+    finally:
+        cursor.close()
+
+
+def insert_rows(connection, table, rows):
+    if not rows:
+        return
+    if connection.dialect.name == 'postgresql':
+        copy_rows(connection, table, rows)
+    else:
+        connection.execute(table.insert(), rows)
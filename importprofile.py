@@ -0,0 +1,40 @@
+"""Профиль времени импорта приложения.
+
+Импорт запускается в отдельном интерпретаторе с -X importtime (в текущем
+процессе модули уже загружены). Время модулей суммируется по пакетам
+верхнего уровня: так видно, во что обходится холодный старт функции на
+Vercel и какой импорт имеет смысл отложить.
+"""
+import os
+import re
+import subprocess
+import sys
+from collections import namedtuple
+
+ImportCost = namedtuple('ImportCost', ['package', 'self_ms', 'modules'])
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+def parse_importtime(lines):
+    """Пары (модуль, собственное время в мкс) из вывода -X importtime."""
+    for line in lines:
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            yield match.group(4), int(match.group(1))
+
+
+def profile(module, cwd=None, env=None):
+    """Стоимость импорта module по пакетам, от самых дорогих к дешевым."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=cwd, env={**os.environ, **(env or {})},
+        capture_output=True, text=True, check=True,
+    )
+    totals = {}
+    for name, self_us in parse_importtime(result.stderr.splitlines()):
+        package = name.split('.')[0]
+        self_ms, modules = totals.get(package, (0.0, 0))
+        totals[package] = (self_ms + self_us / 1000, modules + 1)
+    costs = [ImportCost(package, self_ms, modules) for package, (self_ms, modules) in totals.items()]
+    return sorted(costs, key=lambda c: -c.self_ms)
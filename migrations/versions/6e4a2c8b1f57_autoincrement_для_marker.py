@@ -0,0 +1,49 @@
+"""AUTOINCREMENT для marker
+
+Revision ID: 6e4a2c8b1f57
+Revises: 9c1e5a7f3d20
+Create Date: 2025-06-30 10:42:15.583019
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import fulltext
+
+
+# revision identifiers, used by Alembic.
+revision = '6e4a2c8b1f57'
+down_revision = '9c1e5a7f3d20'
+branch_labels = None
+depends_on = None
+
+
+def recreate_marker(autoincrement):
+    # Только для SQLite: в PostgreSQL последовательность и так не выдает id повторно.
+    # Таблица пересоздается, а вместе со старой удаляются триггеры полнотекстового индекса
+    with op.batch_alter_table('marker', recreate='always',
+                              table_kwargs={'sqlite_autoincrement': autoincrement}) as batch_op:
+        pass
+    for statement in fulltext.SQLITE_DDL:
+        op.execute(statement)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    recreate_marker(True)
+    # Счетчик начинается после id всех меток, в том числе уже перенесенных в архив
+    op.execute(
+        "UPDATE sqlite_sequence SET seq = max(seq, (SELECT coalesce(max(id), 0) FROM marker_archive)) "
+        "WHERE name = 'marker'"
+    )
+    op.execute(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'marker', (SELECT coalesce(max(id), 0) FROM marker_archive) "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'marker')"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    recreate_marker(False)
@@ -0,0 +1,63 @@
+"""Добавлены geohash и индексы в модель Marker
+
+Revision ID: a3c9e1f27b54
+Revises: 2d8a80e2c9a8
+Create Date: 2025-05-12 18:20:41.517204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from geo import geohash_encode
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c9e1f27b54'
+down_revision = '2d8a80e2c9a8'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+marker = sa.table(
+    'marker',
+    sa.column('id', sa.Integer),
+    sa.column('latitude', sa.Float),
+    sa.column('longitude', sa.Float),
+    sa.column('geohash', sa.String),
+)
+
+
+def upgrade():
+    with op.batch_alter_table('marker', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('geohash', sa.String(length=12), nullable=True))
+
+    # Заполнение geohash для уже существующих меток
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(marker.c.id, marker.c.latitude, marker.c.longitude)
+            .where(marker.c.id > last_id)
+            .order_by(marker.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        conn.execute(
+            marker.update().where(marker.c.id == sa.bindparam('marker_id')),
+            [{'marker_id': row.id, 'geohash': geohash_encode(row.latitude, row.longitude)}
+             for row in rows]
+        )
+        last_id = rows[-1].id
+
+    with op.batch_alter_table('marker', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_marker_geohash'), ['geohash'], unique=False)
+        batch_op.create_index(batch_op.f('ix_marker_deadline'), ['deadline'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('marker', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_marker_deadline'))
+        batch_op.drop_index(batch_op.f('ix_marker_geohash'))
+        batch_op.drop_column('geohash')
@@ -0,0 +1,40 @@
+"""Полнотекстовый индекс для marker_archive
+
+Revision ID: b5d19e3c7a42
+Revises: 6e4a2c8b1f57
+Create Date: 2025-07-02 15:21:08.447730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import fulltext
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d19e3c7a42'
+down_revision = '6e4a2c8b1f57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for statement in fulltext.postgres_ddl('marker_archive'):
+            op.execute(statement)
+    elif dialect == 'sqlite':
+        for statement in fulltext.sqlite_ddl('marker_archive'):
+            op.execute(statement)
+        # Заполнение индекса уже перенесенными в архив объявлениями
+        op.execute(fulltext.sqlite_rebuild_ddl('marker_archive'))
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for statement in fulltext.postgres_drop_ddl('marker_archive'):
+            op.execute(statement)
+    elif dialect == 'sqlite':
+        for statement in fulltext.sqlite_drop_ddl('marker_archive'):
+            op.execute(statement)
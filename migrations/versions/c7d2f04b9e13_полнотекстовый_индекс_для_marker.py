@@ -0,0 +1,40 @@
+"""Полнотекстовый индекс для Marker
+
+Revision ID: c7d2f04b9e13
+Revises: a3c9e1f27b54
+Create Date: 2025-05-19 12:04:37.902116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import fulltext
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2f04b9e13'
+down_revision = 'a3c9e1f27b54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for statement in fulltext.POSTGRES_DDL:
+            op.execute(statement)
+    elif dialect == 'sqlite':
+        for statement in fulltext.SQLITE_DDL:
+            op.execute(statement)
+        # Заполнение индекса уже существующими метками
+        op.execute(fulltext.SQLITE_REBUILD_DDL)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for statement in fulltext.POSTGRES_DROP_DDL:
+            op.execute(statement)
+    elif dialect == 'sqlite':
+        for statement in fulltext.SQLITE_DROP_DDL:
+            op.execute(statement)
@@ -0,0 +1,54 @@
+"""Курсорная (keyset) пагинация запросов SQLAlchemy.
+
+Вместо OFFSET следующая страница выбирается условием
+(k1, k2, ...) > (последние значения ключей), поэтому глубокие страницы
+читаются по индексу так же быстро, как первая. Курсор — значения ключей
+последней строки страницы, упакованные в JSON и base64.
+"""
+import base64
+import binascii
+import json
+from collections import namedtuple
+from datetime import date
+
+import sqlalchemy as sa
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, date) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, parsers):
+    """Значения ключей из курсора; ValueError, если курсор поврежден."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError('invalid cursor')
+    if not isinstance(values, list) or len(values) != len(parsers):
+        raise ValueError('invalid cursor')
+    try:
+        return [parse(value) for parse, value in zip(parsers, values)]
+    except (TypeError, ValueError):
+        raise ValueError('invalid cursor')
+
+
+def paginate(query, keys, cursor=None, page_size=20):
+    """Одна страница query, упорядоченного по возрастанию ключей keys.
+
+    keys — список пар (выражение, функция разбора значения из курсора);
+    последним ключом должен идти уникальный столбец, обычно id.
+    """
+    exprs = [expr for expr, _ in keys]
+    if cursor:
+        values = decode_cursor(cursor, [parse for _, parse in keys])
+        query = query.filter(sa.tuple_(*exprs) > sa.tuple_(*values))
+    rows = query.add_columns(*exprs).order_by(*exprs).limit(page_size + 1).all()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(list(rows[-1][1:]))
+    return Page([row[0] for row in rows], next_cursor)
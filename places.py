@@ -0,0 +1,142 @@
+"""Нормализация адресов объявлений и справочник канонических мест.
+
+Справочник строится из CITY_COORDINATES (координаты с одинаковыми
+значениями считаются одним местом, первое имя — каноническим) и
+дополняется файлом data/places.json. Каждое название и синоним кладутся
+в словарь по нормализованному ключу, поэтому определение места по
+адресу — несколько обращений к словарю.
+"""
+import json
+import os
+import re
+from collections import namedtuple
+
+CITY_COORDINATES = {
+    # Города Казахстана
+    "алматы": (43.238949, 76.889709),
+    "алмата": (43.238949, 76.889709),
+    "астана": (51.1605, 71.4704),
+    "нур-султан": (51.1605, 71.4704),
+    "нур султан": (51.1605, 71.4704),
+    "шымкент": (42.3417, 69.5901),
+    "караганда": (49.8065, 73.0871),
+    "таразы": (42.9046, 71.3894),
+    "уст-каменогорск": (49.9761, 82.6061),
+    "павлодар": (52.2833, 76.9667),
+    "костанай": (53.222, 63.619),
+    "аттырау": (47.1308, 51.9234),
+    "уральск": (51.2401, 51.2012),
+    "актау": (44.9989, 51.8892),
+
+    # Популярные города России
+    "москва": (55.7558, 37.6176),
+    "санкт-петербург": (59.9311, 30.3609),
+    "новосибирск": (55.0084, 82.9357),
+    "екатеринбург": (56.8389, 60.6057),
+    "казань": (55.8304, 49.0661),
+    "самара": (53.1959, 50.1000),
+    "омск": (54.9893, 73.3682),
+    "челябинск": (55.1644, 61.4368),
+    "ростов-на-дону": (47.2357, 39.7015),
+    "уфа": (54.7388, 55.9721),
+    "волгоград": (48.7080, 44.5133),
+    "краснодар": (45.0443, 38.9760),
+    "воронеж": (51.6615, 39.2003),
+    "нижний новгород": (56.2965, 43.9361),
+    "пермь": (58.0000, 56.2500)
+}
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'places.json')
+
+# Типы населенных пунктов, которые пишут перед названием
+SETTLEMENT_PREFIXES = ('г', 'гор', 'город', 'с', 'село', 'п', 'пос', 'поселок', 'пгт', 'аул', 'мкр')
+MAX_NAME_WORDS = 3
+
+Place = namedtuple('Place', ['name', 'latitude', 'longitude'])
+
+
+def normalize_text(text):
+    return re.sub(r'\s+', ' ', text.strip().lower().replace('ё', 'е'))
+
+
+def alias_key(text):
+    """Ключ для сравнения названий: без регистра, дефисов и знаков препинания."""
+    return ' '.join(re.findall(r'\w+', normalize_text(text)))
+
+
+class PlaceIndex:
+    def __init__(self):
+        self.places = {}
+        self.aliases = {}
+
+    def add(self, name, latitude, longitude, aliases=()):
+        """Добавляет место или дополняет уже известное.
+
+        Если name или один из синонимов уже указывает на место, оно
+        переименовывается в name, а все названия становятся его синонимами.
+        """
+        name = normalize_text(name)
+        keys = [alias_key(a) for a in (name, *aliases)]
+        existing = next((self.aliases[k] for k in keys if k in self.aliases), None)
+        if existing is not None and existing != name:
+            del self.places[existing]
+            for key, value in self.aliases.items():
+                if value == existing:
+                    self.aliases[key] = name
+            keys.append(alias_key(existing))
+        self.places[name] = Place(name, latitude, longitude)
+        for key in keys:
+            self.aliases[key] = name
+
+    def load(self, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        for item in data.get('places', []):
+            self.add(item['name'], item['lat'], item['lng'], item.get('aliases', ()))
+
+    @classmethod
+    def build(cls, coordinates=CITY_COORDINATES, data_file=DATA_FILE):
+        index = cls()
+        by_coords = {}
+        for name, coords in coordinates.items():
+            by_coords.setdefault(coords, []).append(name)
+        for (lat, lng), names in by_coords.items():
+            index.add(names[0], lat, lng, names[1:])
+        if data_file and os.path.exists(data_file):
+            index.load(data_file)
+        return index
+
+    def lookup(self, name):
+        """Место по точному названию или синониму."""
+        canonical = self.aliases.get(alias_key(name))
+        return self.places[canonical] if canonical else None
+
+    def resolve(self, location_text):
+        """Место, упомянутое в адресе вида 'г. Алматы, ул. Абая 1', или None."""
+        for part in normalize_text(location_text).split(','):
+            words = re.findall(r'\w+', part)
+            if words and words[0] in SETTLEMENT_PREFIXES and len(words) > 1:
+                words = words[1:]
+            for n in range(min(MAX_NAME_WORDS, len(words)), 0, -1):
+                canonical = self.aliases.get(' '.join(words[:n]))
+                if canonical:
+                    return self.places[canonical]
+        return None
+
+
+place_index = PlaceIndex.build()
+
+
+def place_key(location_text):
+    place = place_index.resolve(location_text)
+    return place.name if place else None
+
+
+def location_key(location_text):
+    """Ключ места для рейтинга: каноническое место или нормализованный адрес."""
+    return place_key(location_text) or normalize_text(location_text)
+
+
+def city_key(location_text):
+    """Город из адреса: каноническое место или часть адреса до первой запятой."""
+    return place_key(location_text) or normalize_text(location_text.split(',', 1)[0])
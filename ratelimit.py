@@ -0,0 +1,188 @@
+"""Ограничение частоты запросов и числа одновременных тяжелых запросов.
+
+Алгоритмы:
+
+- TokenBucket(rate, burst) — в ведре до burst жетонов, пополняется со
+  скоростью rate жетонов в секунду, запрос тратит один жетон. Допускает
+  короткие всплески и держит среднюю скорость;
+- SlidingWindow(limit, window) — не больше limit запросов за любые window
+  секунд. Счет приближенный: текущее окно плюс прошлое с весом по доле
+  перекрытия, так что на ключ хранятся три числа.
+
+Состояние ключей хранит бэкенд: MemoryBackend — в памяти процесса,
+SQLiteBackend — в файле SQLite, общем для всех воркеров gunicorn на одной
+машине, чтобы предел действовал на клиента, а не на воркер.
+
+ConcurrencyGate ограничивает число одновременно выполняемых тяжелых
+запросов в процессе: лишние сразу получают отказ вместо очереди из
+зависших воркеров.
+"""
+import math
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+Decision = namedtuple('Decision', ['allowed', 'retry_after'])
+
+# Просроченные ключи вычищаются раз в столько обращений
+SWEEP_INTERVAL = 1000
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        # За это время ведро наполняется целиком и ключ можно забыть
+        self.ttl = burst / rate
+
+    def initial(self, now):
+        return (float(self.burst), now, 0.0)
+
+    def hit(self, state, now):
+        tokens, updated, _ = state
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            return Decision(True, 0.0), (tokens - 1, now, 0.0)
+        return Decision(False, (1 - tokens) / self.rate), (tokens, now, 0.0)
+
+
+class SlidingWindow:
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.ttl = 2 * window
+
+    def initial(self, now):
+        return (self._start(now), 0.0, 0.0)
+
+    def _start(self, now):
+        return math.floor(now / self.window) * self.window
+
+    def hit(self, state, now):
+        start, current, previous = state
+        window_start = self._start(now)
+        if window_start != start:
+            previous = current if window_start - start == self.window else 0.0
+            current = 0.0
+        elapsed = now - window_start
+        weight = 1 - elapsed / self.window
+        if previous * weight + current + 1 <= self.limit:
+            return Decision(True, 0.0), (window_start, current + 1, previous)
+        if previous and current + 1 <= self.limit:
+            # Момент, когда вес прошлого окна упадет достаточно
+            retry_after = self.window * (1 - (self.limit - current - 1) / previous) - elapsed
+        else:
+            retry_after = self.window - elapsed
+        return Decision(False, max(retry_after, 0.0)), (window_start, current, previous)
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # ключ -> (состояние, срок хранения)
+        self._entries = {}
+        self._hits = 0
+
+    def update(self, key, algorithm, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            state = entry[0] if entry is not None and entry[1] > now else algorithm.initial(now)
+            decision, state = algorithm.hit(state, now)
+            self._entries[key] = (state, now + algorithm.ttl)
+            self._hits += 1
+            if self._hits % SWEEP_INTERVAL == 0:
+                self._entries = {k: v for k, v in self._entries.items() if v[1] > now}
+        return decision
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._hits = 0
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS limits ('
+                         'key TEXT PRIMARY KEY, a REAL NOT NULL, b REAL NOT NULL, c REAL NOT NULL, '
+                         'expires REAL NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def update(self, key, algorithm, now):
+        conn = self._connect()
+        # IMMEDIATE сразу берет блокировку записи: чтение и запись состояния атомарны
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT a, b, c, expires FROM limits WHERE key = ?', (key,)).fetchone()
+            state = row[:3] if row is not None and row[3] > now else algorithm.initial(now)
+            decision, state = algorithm.hit(state, now)
+            conn.execute('INSERT OR REPLACE INTO limits (key, a, b, c, expires) VALUES (?, ?, ?, ?, ?)',
+                         (key, *state, now + algorithm.ttl))
+            self._hits += 1
+            if self._hits % SWEEP_INTERVAL == 0:
+                conn.execute('DELETE FROM limits WHERE expires <= ?', (now,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return decision
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM limits').fetchone()[0]
+
+
+class NullBackend:
+    def update(self, key, algorithm, now):
+        return Decision(True, 0.0)
+
+    def __len__(self):
+        return 0
+
+
+class RateLimiter:
+    def __init__(self, name, algorithm, backend):
+        self.name = name
+        self.algorithm = algorithm
+        self.backend = backend
+
+    def hit(self, key):
+        return self.backend.update(f'{self.name}:{key}', self.algorithm, time.time())
+
+
+class ConcurrencyGate:
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+def create_backend(backend, path=None):
+    if backend == 'memory':
+        return MemoryBackend()
+    if backend == 'sqlite':
+        return SQLiteBackend(path)
+    if backend == 'none':
+        return NullBackend()
+    raise ValueError(f'unknown rate limit backend: {backend}')
@@ -0,0 +1,60 @@
+"""Счетчики агрегатов, которые обновляются вместе с записью меток.
+
+Увеличение счетчика выполняется одним UPSERT (INSERT ... ON CONFLICT DO
+UPDATE) на том же соединении, что и запись метки, поэтому агрегаты
+фиксируются в той же транзакции.
+"""
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+
+_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+
+def increment(connection, table, keys, delta, column='count', extra=None):
+    """Прибавляет delta к счетчику строки table с ключом keys.
+
+    extra — значения остальных столбцов, которые записываются только при
+    создании строки. Строки, счетчик которых опустился до нуля, удаляются.
+    """
+    if delta == 0:
+        return
+    values = dict(keys, **(extra or {}))
+    counter = table.c[column]
+    where = sa.and_(*(table.c[k] == v for k, v in keys.items()))
+    insert = _INSERTS.get(connection.dialect.name)
+    if insert is not None and delta > 0:
+        stmt = insert(table).values(**values, **{column: delta})
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: counter + stmt.excluded[column]}
+        )
+        connection.execute(stmt)
+        return
+    updated = connection.execute(table.update().where(where).values({column: counter + delta}))
+    if updated.rowcount == 0 and delta > 0:
+        connection.execute(table.insert().values(**values, **{column: delta}))
+    elif delta < 0:
+        connection.execute(table.delete().where(where, counter <= 0))
+
+
+def increment_all(connection, table, key, values, column='count'):
+    """Прибавляет единицу к счетчикам строк table, где столбец key равен одному из values.
+
+    Все строки обновляются одним UPSERT. Значения сортируются: параллельные
+    транзакции блокируют строки в одном порядке и не ждут друг друга по кругу.
+    """
+    values = sorted(set(values))
+    insert = _INSERTS.get(connection.dialect.name)
+    if insert is None:
+        for value in values:
+            increment(connection, table, {key: value}, 1, column=column)
+        return
+    stmt = insert(table).values([{key: value, column: 1} for value in values])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[key],
+        set_={column: table.c[column] + stmt.excluded[column]}
+    )
+    connection.execute(stmt)
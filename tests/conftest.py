@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py читает настройки при импорте: тесты работают с временной базой и без общих кэшей
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+os.environ.setdefault('EVENTS_BACKEND', 'local')
+os.environ.setdefault('PAGE_CACHE_BACKEND', 'none')
+os.environ.setdefault('RATELIMIT_BACKEND', 'none')
+os.environ.setdefault('TEMPLATE_BYTECODE_DIR', '')
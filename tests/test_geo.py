@@ -0,0 +1,89 @@
+import math
+import random
+
+import pytest
+
+from geo import bbox_contains, geohash_encode, geohash_ranges, haversine_km, radius_bbox
+
+
+def split_antimeridian(south, west, north, east):
+    # Как bbox_filter в app.py: прямоугольник через 180-й меридиан — две части
+    if west > east:
+        return [(south, west, north, 180.0), (south, -180.0, north, east)]
+    return [(south, west, north, east)]
+
+
+def covered(bbox, lat, lng):
+    """Попадает ли geohash точки в диапазоны geohash_ranges для bbox."""
+    code = geohash_encode(lat, lng)
+    for part in split_antimeridian(*bbox):
+        ranges = geohash_ranges(*part)
+        if ranges is None:
+            return True
+        if any(start <= code and (stop is None or code < stop) for start, stop in ranges):
+            return True
+    return False
+
+
+def random_points(bbox, count=500, seed=0):
+    south, west, north, east = bbox
+    width = (east - west) % 360.0 or 360.0
+    rng = random.Random(seed)
+    for _ in range(count):
+        lng = (west + rng.uniform(0.0, width) + 180.0) % 360.0 - 180.0
+        yield rng.uniform(south, north), lng
+
+
+@pytest.mark.parametrize('bbox', [
+    (55.70, 37.55, 55.80, 37.70),
+    # Через 180-й меридиан
+    (64.0, 175.0, 66.0, -175.0),
+    (-18.2, 179.9, -17.9, -179.9),
+    # У полюсов и до самого полюса
+    (89.5, -10.0, 90.0, 10.0),
+    (-90.0, -180.0, -89.0, 180.0),
+    (85.0, 170.0, 90.0, -170.0),
+])
+def test_geohash_ranges_cover_every_point(bbox):
+    for lat, lng in random_points(bbox):
+        assert bbox_contains(bbox, lat, lng)
+        assert covered(bbox, lat, lng), (lat, lng)
+
+
+def test_geohash_ranges_include_edges():
+    bbox = (43.0, 76.0, 43.5, 77.0)
+    for lat, lng in [(43.0, 76.0), (43.5, 77.0), (43.0, 77.0), (43.5, 76.0)]:
+        assert covered(bbox, lat, lng)
+
+
+@pytest.mark.parametrize('center, km', [
+    ((51.1605, 71.4704), 25),
+    ((55.7558, 37.6176), 500),
+    # Круг через 180-й меридиан и круг, накрывающий полюс
+    ((65.0, 179.5), 100),
+    ((-16.5, -179.8), 300),
+    ((89.0, 30.0), 250),
+    ((-88.5, -120.0), 400),
+])
+def test_radius_query_matches_brute_force(center, km):
+    lat, lng = center
+    bbox = radius_bbox(lat, lng, km)
+    # Точки вокруг центра с запасом в два радиуса, по долготе — с поправкой на широту
+    dlat = 2 * km / 111.0
+    dlng = min(180.0, dlat / max(math.cos(math.radians(lat)), 0.01))
+    rng = random.Random(1)
+    points = [(max(-90.0, min(90.0, lat + rng.uniform(-dlat, dlat))),
+               (lng + rng.uniform(-dlng, dlng) + 180.0) % 360.0 - 180.0) for _ in range(5000)]
+    inside = [(p_lat, p_lng) for p_lat, p_lng in points if haversine_km(lat, lng, p_lat, p_lng) <= km]
+    assert inside
+    # Отбор по прямоугольнику и geohash не теряет ни одной точки круга
+    found = [(p_lat, p_lng) for p_lat, p_lng in points
+             if bbox_contains(bbox, p_lat, p_lng) and covered(bbox, p_lat, p_lng)
+             and haversine_km(lat, lng, p_lat, p_lng) <= km]
+    assert found == inside
+
+
+def test_haversine_known_distance():
+    # Алматы — Астана, около 970 км
+    assert haversine_km(43.238949, 76.889709, 51.1605, 71.4704) == pytest.approx(970, abs=10)
+    assert haversine_km(0.0, 179.9, 0.0, -179.9) == pytest.approx(22.24, abs=0.05)
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import geocoder
+from geocoder import GAZETTEER_FILE, Geocoder
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def gazetteer():
+    return Geocoder().load(GAZETTEER_FILE)
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('мос', 'москва'),
+    ('караг', 'караганда'),
+    ('екат', 'екатеринбург'),
+    ('алм', 'алматы'),
+    ('аламты', 'алматы'),
+    ('Almaty', 'алматы'),
+])
+def test_top_result(gazetteer, query, expected):
+    assert gazetteer.search(query, 5)[0].settlement.name == expected
+
+
+@pytest.mark.parametrize('seed', ['0', '1', '2'])
+def test_fuzzy_search_does_not_depend_on_hash_seed(seed):
+    # Порядок обхода множеств зависит от PYTHONHASHSEED, результат — нет
+    code = "import geocoder as g; print([m.settlement.name for m in g.Geocoder().load(g.GAZETTEER_FILE).search('аламты')])"
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True,
+                            env={**os.environ, 'PYTHONHASHSEED': seed}).stdout
+    assert output.strip() == "['алматы']"
+
+
+def test_shipped_names_are_cyrillic():
+    with open(GAZETTEER_FILE, encoding='utf-8') as f:
+        names = [line.split('\t', 1)[0] for line in f if line.strip() and not line.startswith('#')]
+    assert names
+    assert all(any(ch in geocoder.TRANSLIT for ch in name.lower()) for name in names)
+
+
+def test_read_geonames_prefers_russian_names(tmp_path):
+    dump = tmp_path / 'cities.txt'
+    alias_dump = tmp_path / 'alternate.txt'
+    dump.write_text('\t'.join([
+        '1526384', 'Almaty', 'Almaty', 'Алма-Ата,Алмати,Алматы,Вірний', '43.25', '76.91', 'P', 'PPLA', 'KZ',
+        '', '02', '', '', '', '1977011', '', '', 'Asia/Almaty', '',
+    ]) + '\n', encoding='utf-8')
+    (settlement, aliases), = geocoder.read_geonames(dump)
+    # Без выгрузки альтернативных названий — синоним, ближайший к ASCII-названию
+    assert settlement.name == 'Алматы'
+    assert 'Almaty' in aliases and 'Алматы' not in aliases
+
+    alias_dump.write_text('1\t1526384\tru\tАлма-Ата\t\t\t\t1\n'
+                          '2\t1526384\tkk\tАлматы\t1\t\t\t\n'
+                          '3\t1526384\tru\tГород Алматы\t1\t\t\t\n', encoding='utf-8')
+    names = geocoder.read_russian_names(alias_dump)
+    (settlement, _), = geocoder.read_geonames(dump, russian_names=names)
+    assert settlement.name == 'Город Алматы'
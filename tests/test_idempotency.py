@@ -0,0 +1,42 @@
+import pytest
+
+from app import IdempotencyKey, Marker, app, db
+
+MARKER = {'help_needed': 'вода', 'location': 'Москва', 'deadline': '2099-01-01',
+          'contact': '+7 900 000-00-00', 'lat': 55.75, 'lng': 37.62}
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+
+
+@pytest.mark.parametrize('invalid', [{'lat': 'nan'}, {'help_needed': None}, {'contact': ''}])
+def test_invalid_request_does_not_take_the_key(client, invalid):
+    headers = {'Idempotency-Key': 'retry-after-fix'}
+    response = client.post('/add_marker', json={**MARKER, **invalid}, headers=headers)
+    assert response.status_code == 400
+
+    response = client.post('/add_marker', json=MARKER, headers=headers)
+    assert response.status_code == 200
+    marker_id = response.get_json()['marker_id']
+
+    # Повтор исправленного запроса отдает сохраненный ответ и не создает вторую метку
+    replay = client.post('/add_marker', json=MARKER, headers=headers)
+    assert replay.status_code == 200
+    assert replay.get_json()['marker_id'] == marker_id
+    with app.app_context():
+        assert Marker.query.count() == 1
+        assert IdempotencyKey.query.count() == 1
+
+
+def test_key_reused_with_another_body_is_rejected(client):
+    headers = {'Idempotency-Key': 'reused'}
+    assert client.post('/add_marker', json=MARKER, headers=headers).status_code == 200
+    response = client.post('/add_marker', json={**MARKER, 'contact': 'other'}, headers=headers)
+    assert response.status_code == 422
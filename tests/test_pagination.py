@@ -0,0 +1,65 @@
+import math
+from types import SimpleNamespace
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session, declarative_base
+
+import fulltext
+from pagination import paginate
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = 'item'
+    id = sa.Column(sa.Integer, primary_key=True)
+    rank = sa.Column(sa.Float, nullable=False)
+
+
+# Равные ранги и ранги, отличающиеся в последнем знаке, вперемешку
+BASE_RANK = 0.1 + 0.2
+RANKS = [0.3, BASE_RANK, math.nextafter(BASE_RANK, 1.0), 0.3, BASE_RANK,
+         -0.0607927, -0.060792699456214905, math.nextafter(0.3, 0.0)] * 3
+
+
+@pytest.fixture
+def session():
+    engine = sa.create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all(Item(id=i, rank=rank) for i, rank in enumerate(RANKS, 1))
+        session.commit()
+        yield session
+
+
+@pytest.mark.parametrize('page_size', [1, 2, 3, 5, 7])
+def test_pages_over_equal_and_near_equal_ranks(session, page_size):
+    keys = [(Item.rank, float), (Item.id, int)]
+    seen = []
+    cursor = None
+    while True:
+        page = paginate(session.query(Item), keys, cursor, page_size)
+        seen.extend(item.id for item in page.items)
+        if page.next_cursor is None:
+            break
+        cursor = page.next_cursor
+    expected = [i for _, i in sorted((rank, i) for i, rank in enumerate(RANKS, 1))]
+    assert seen == expected
+
+
+def test_postgres_rank_is_double_precision():
+    # Курсор хранит ранг как float8; real из ts_rank с ним не сравнивается точно
+    model = type('Marker', (declarative_base(),), {
+        '__tablename__': 'marker',
+        'id': sa.Column(sa.Integer, primary_key=True),
+        'location_text': sa.Column(sa.String),
+        'help_needed': sa.Column(sa.String),
+    })
+    fulltext.register(model.__table__)
+    engine = SimpleNamespace(dialect=postgresql.dialect(), url='postgresql://test/rank')
+    _, rank = fulltext.search(sa.select(model.id), model, engine, 'помощь')
+    sql = str(sa.select(rank).compile(dialect=postgresql.dialect()))
+    assert sql.startswith('SELECT CAST(-ts_rank(')
+    assert 'AS FLOAT(53))' in sql
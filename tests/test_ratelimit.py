@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+
+import app as app_module
+import ratelimit
+from ratelimit import MemoryBackend, SlidingWindow, SQLiteBackend, TokenBucket
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / 'limits.db'))
+
+
+def hits(backend, algorithm, now, count, key='client'):
+    return [backend.update(key, algorithm, now) for _ in range(count)]
+
+
+def test_token_bucket_limit_and_refill(backend):
+    bucket = TokenBucket(rate=2.0, burst=3)
+    assert all(decision.allowed for decision in hits(backend, bucket, 100.0, 3))
+    refused = backend.update('client', bucket, 100.0)
+    assert not refused.allowed
+    assert refused.retry_after == pytest.approx(0.5)
+    # Другой ключ считается отдельно
+    assert backend.update('other', bucket, 100.0).allowed
+    # Через retry_after в ведре ровно один жетон
+    assert backend.update('client', bucket, 100.0 + refused.retry_after).allowed
+    assert not backend.update('client', bucket, 100.0 + refused.retry_after).allowed
+    # За burst / rate секунд ведро наполняется целиком
+    assert all(decision.allowed for decision in hits(backend, bucket, 110.0, 3))
+
+
+def test_sliding_window_limit_and_refill(backend):
+    window = SlidingWindow(limit=3, window=10)
+    assert all(decision.allowed for decision in hits(backend, window, 100.0, 3))
+    refused = backend.update('client', window, 105.0)
+    assert not refused.allowed
+    assert refused.retry_after == pytest.approx(5.0)
+    # В начале следующего окна прошлое еще весит целиком, затем его вес убывает
+    refused = backend.update('client', window, 110.0)
+    assert not refused.allowed
+    assert backend.update('client', window, 110.0 + refused.retry_after + 1e-6).allowed
+    # Через два окна прошлые запросы не учитываются
+    assert all(decision.allowed for decision in hits(backend, window, 130.0, 3))
+
+
+@pytest.mark.parametrize('kind', ['memory', 'sqlite'])
+def test_http_429_with_retry_after(monkeypatch, tmp_path, kind):
+    backend = MemoryBackend() if kind == 'memory' else SQLiteBackend(str(tmp_path / 'limits.db'))
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(ratelimit, 'time', SimpleNamespace(time=lambda: clock.now))
+    monkeypatch.setattr(app_module.search_limit, 'backend', backend)
+    client = app_module.app.test_client()
+
+    for _ in range(app_module.SEARCH_BURST):
+        assert client.get('/api/announcements').status_code == 200
+    response = client.get('/api/announcements')
+    assert response.status_code == 429
+    assert response.get_json()['status'] == 'error'
+    assert response.headers['Retry-After'] == '1'
+
+    # Повтор через указанное в Retry-After время проходит
+    clock.now += int(response.headers['Retry-After'])
+    assert client.get('/api/announcements').status_code == 200
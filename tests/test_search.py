@@ -0,0 +1,42 @@
+from datetime import date, timedelta
+
+import pytest
+
+from app import Marker, app, archive_expired, db
+
+TEXTS = ['Собака потерялась', 'ищем собаку', 'СОБАКА нашлась', 'кошка', 'собака рыжая']
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for i, text in enumerate(TEXTS):
+            db.session.add(Marker(help_needed=text, offer='', location_text='Москва', contact='c',
+                                  latitude=55.75, longitude=37.62,
+                                  deadline=date.today() + timedelta(days=-1 if i < 4 else 3)))
+        db.session.commit()
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+
+
+def found_ids(client, q, per_page=2):
+    ids, cursor = [], None
+    while True:
+        params = {'q': q, 'per_page': per_page, **({'cursor': cursor} if cursor else {})}
+        data = client.get('/api/search', query_string=params).get_json()
+        ids.extend(marker['id'] for marker in data['markers'])
+        cursor = data['next_cursor']
+        if not cursor:
+            return ids
+
+
+@pytest.mark.parametrize('q', ['собака', 'Собак'])
+def test_archived_markers_stay_searchable(client, q):
+    before = found_ids(client, q)
+    with app.app_context():
+        assert archive_expired() == 4
+    # Архив ищется по своему полнотекстовому индексу, с тем же учетом регистра кириллицы
+    assert sorted(found_ids(client, q)) == sorted(before)